@@ -0,0 +1,159 @@
+import os
+
+# NumPy is only needed for the columnar reports, so it is imported on first use
+np = None
+
+def _numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("The columnar reports require numpy (pip install numpy)")
+        np = numpy
+    return np
+
+# Day numbers count days since 1970-01-01, the same origin as datetime64[D]
+_EPOCH_JULIAN_DAY = 2440587.5
+
+def _snapshot_signature(db):
+    # The transactions' change counter, bumped by a trigger on every insert, delete and update, plus
+    # the account and category names the snapshot decodes its codes with
+    cursor = db.conn.cursor()
+    cursor.execute('SELECT changes FROM change_counter WHERE id = 1')
+    signature = [str(cursor.fetchone()[0])]
+    for table in ('accounts', 'categories'):
+        cursor.execute(f"SELECT COALESCE(group_concat(id || ':' || name, ','), '') FROM "
+                       f"(SELECT id, name FROM {table} ORDER BY id)")
+        signature.append(cursor.fetchone()[0])
+    cursor.close()
+    return signature
+
+def load_columns(db, cache_path=None, refresh=False):
+    # Load every transaction into compact column arrays:
+    #   id int64, amount int64 cents, day int32 (days since 1970-01-01),
+    #   account and category int32 codes (their database ids),
+    #   plus account_ids/account_names and category_ids/category_names to decode the codes
+    np = _numpy()
+
+    # np.savez appends .npz to paths without it, look for the file it actually writes
+    if cache_path and not cache_path.endswith('.npz'):
+        cache_path += '.npz'
+
+    signature = _snapshot_signature(db) if cache_path else None
+
+    # Reuse the .npz snapshot as long as the transactions haven't changed since it was written
+    if cache_path and not refresh and os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            if list(cached['signature']) == signature:
+                return {key: cached[key] for key in cached.files if key != 'signature'}
+
+    cursor = db.conn.cursor()
+
+    # CAST keeps SQLite from handing the values to the CENTS/DATE converters
+    cursor.execute('SELECT id, CAST(amount AS INTEGER), '
+                   f'CAST(julianday(substr(t_date, 1, 10)) - {_EPOCH_JULIAN_DAY} AS INTEGER), '
+                   'account_id, category_id FROM transactions ORDER BY t_date, id')
+    rows = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 5)
+
+    cursor.execute('SELECT id, name FROM accounts ORDER BY id')
+    accounts = cursor.fetchall()
+    cursor.execute('SELECT id, name FROM categories ORDER BY id')
+    categories = cursor.fetchall()
+    cursor.close()
+
+    columns = {
+        'id': rows[:, 0].copy(),
+        'amount': rows[:, 1].copy(),
+        'day': rows[:, 2].astype(np.int32),
+        'account': rows[:, 3].astype(np.int32),
+        'category': rows[:, 4].astype(np.int32),
+        'account_ids': np.array([row[0] for row in accounts], dtype=np.int32),
+        'account_names': np.array([row[1] for row in accounts], dtype=str),
+        'category_ids': np.array([row[0] for row in categories], dtype=np.int32),
+        'category_names': np.array([row[1] for row in categories], dtype=str),
+    }
+
+    if cache_path:
+        np.savez(cache_path, signature=np.array(signature, dtype=str), **columns)
+
+    return columns
+
+def _select(columns, account=None, category=None):
+    # Boolean mask for the rows of one account and/or category code
+    np = _numpy()
+    mask = np.ones(len(columns['id']), dtype=bool)
+    if account is not None:
+        mask &= columns['account'] == account
+    if category is not None:
+        mask &= columns['category'] == category
+    return mask
+
+def group_sum(keys, values):
+    # Exact int64 sums of values per distinct key, returned as (sorted keys, sums)
+    np = _numpy()
+    if len(keys) == 0:
+        return keys[:0], values[:0]
+
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(sorted_keys)) + 1))
+    return sorted_keys[starts], np.add.reduceat(values[order], starts)
+
+def month_numbers(days):
+    # Months since 1970-01, so year = 1970 + month // 12 and month of year = month % 12 + 1
+    np = _numpy()
+    return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int32)
+
+def monthly_totals(columns, account=None, category=None):
+    mask = _select(columns, account, category)
+    return group_sum(month_numbers(columns['day'][mask]), columns['amount'][mask])
+
+def category_totals(columns, account=None):
+    mask = _select(columns, account=account)
+    return group_sum(columns['category'][mask], columns['amount'][mask])
+
+def account_totals(columns, category=None):
+    mask = _select(columns, category=category)
+    return group_sum(columns['account'][mask], columns['amount'][mask])
+
+def monthly_category_totals(columns, account=None):
+    # Returns (months, category codes, sums) for every (month, category) pair with activity
+    np = _numpy()
+    mask = _select(columns, account=account)
+    months = month_numbers(columns['day'][mask]).astype(np.int64)
+    categories = columns['category'][mask].astype(np.int64)
+
+    # Pack both keys into one int64 so a single sort groups them
+    keys, sums = group_sum(months << 32 | categories, columns['amount'][mask])
+    return (keys >> 32).astype(np.int32), (keys & 0xFFFFFFFF).astype(np.int32), sums
+
+def running_balance(columns, account=None, category=None):
+    # Balance after each transaction, in (day, id) order; returns (days, balances)
+    np = _numpy()
+    mask = _select(columns, account, category)
+    days = columns['day'][mask]
+    order = np.lexsort((columns['id'][mask], days))
+    return days[order], np.cumsum(columns['amount'][mask][order])
+
+def daily_totals(columns, account=None, category=None):
+    # Net amount for every calendar day between the first and last transaction, including quiet days;
+    # returns (first day, totals)
+    np = _numpy()
+    mask = _select(columns, account, category)
+    days, sums = group_sum(columns['day'][mask], columns['amount'][mask])
+    if len(days) == 0:
+        return 0, np.zeros(0, dtype=np.int64)
+
+    totals = np.zeros(int(days[-1]) - int(days[0]) + 1, dtype=np.int64)
+    totals[days - days[0]] = sums
+    return int(days[0]), totals
+
+def rolling_average(columns, window=30, account=None, category=None):
+    # Trailing window-day average of the daily net amount, in cents; returns (first day, averages)
+    np = _numpy()
+    first_day, totals = daily_totals(columns, account, category)
+    sums = np.cumsum(totals)
+    sums[window:] = sums[window:] - sums[:-window]
+    counts = np.minimum(np.arange(1, len(totals) + 1), window)
+    return first_day, sums / counts
@@ -0,0 +1,290 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import date, timedelta
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+import quicken
+import transaction_db
+
+# Benchmark harness: generates synthetic statements and ledgers, times the main operations,
+# each in a fresh process so the reported peak RSS belongs to that operation alone, and prints
+# the results as JSON, e.g.
+#   python benchmark.py --sizes 10k,100k --output results.json
+
+CASES = ('import', 'dedupe', 'add', 'recalc', 'listing', 'query', 'remove_category')
+
+# Vendors per category, the rules created with each ledger map them back to their category
+VENDORS = {
+    'groceries': ['Safeway', 'Trader Joes', 'Whole Foods', 'Costco', 'Aldi'],
+    'dining': ['Starbucks', 'Chipotle', 'Pizza Hut', 'Local Diner', 'Sushi Bar'],
+    'transport': ['Shell', 'Chevron', 'Uber', 'Lyft', 'Metro Transit'],
+    'shopping': ['Amazon', 'Target', 'Best Buy', 'Ikea', 'Home Depot'],
+    'utilities': ['City Power', 'Water Dept', 'Comcast', 'Verizon', 'Gas Co'],
+}
+MEMOS = ['purchase', 'card payment', 'recurring', 'refund', 'online order', 'pos debit']
+
+ACCOUNT = 'checking'
+ACCTID = '000123456'
+ADD_COUNT = 1000
+PAGE_SIZE = 500
+
+def parse_size(value):
+    # 10000, 10k or 1m
+    value = value.strip().lower()
+    multiplier = {'k': 1000, 'm': 1000000}.get(value[-1:], 1)
+    return int(value.rstrip('km')) * multiplier
+
+def synthetic_transactions(count, seed=0, start=date(2015, 1, 1)):
+    # Deterministic stream of uncategorized statement records spread over roughly ten years
+    rng = random.Random(seed)
+    categories = list(VENDORS)
+    step = max(1, count // 3650)
+
+    for index in range(count):
+        category = categories[rng.randrange(len(categories))]
+        yield transaction_db.Transaction(
+            vendor=VENDORS[category][rng.randrange(5)],
+            amount=Decimal(rng.randint(-25000, 5000)).scaleb(-2),
+            category='uncategorized',
+            memo=f'{MEMOS[rng.randrange(len(MEMOS))]} {rng.randrange(100000):05d}',
+            date=start + timedelta(days=index // step),
+            fitid=f'{seed:04d}{index:09d}',
+        )
+
+def write_qfx(path, transactions, acctid=ACCTID):
+    with open(path, 'w', encoding='utf-8') as qfx:
+        qfx.write('<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS>'
+                  f'<BANKACCTFROM><ACCTID>{acctid}</ACCTID></BANKACCTFROM><BANKTRANLIST>\n')
+        for trans in transactions:
+            qfx.write(f'<STMTTRN><TRNTYPE>{"DEBIT" if trans.amount < 0 else "CREDIT"}</TRNTYPE>'
+                      f'<DTPOSTED>{trans.date:%Y%m%d}120000.000</DTPOSTED><TRNAMT>{trans.amount}</TRNAMT>'
+                      f'<FITID>{trans.fitid}</FITID><NAME>{escape(trans.vendor)}</NAME>'
+                      f'<MEMO>{escape(trans.memo)}</MEMO></STMTTRN>\n')
+        qfx.write('</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>\n')
+
+def setup_ledger(db):
+    # The account, categories and rules every benchmark ledger starts with
+    db.add_account(ACCOUNT)
+    db.link_account(ACCOUNT, ACCTID)
+    for category, vendors in VENDORS.items():
+        db.add_category(category)
+        for vendor in vendors:
+            db.add_rule(category, vendor=vendor)
+
+def fixture_paths(workdir, size, seed):
+    # Databases are tied to the schema version so runs across commits never share an incompatible file
+    base = os.path.join(workdir, f'ledger-{size}-{seed}')
+    return base + '.qfx', f'{base}-v{transaction_db.SCHEMA_VERSION}.db'
+
+def generate_fixtures(workdir, size, seed):
+    # Write the statement and the ledger populated from it, unless an earlier run already did
+    qfx_path, db_path = fixture_paths(workdir, size, seed)
+
+    if not os.path.exists(qfx_path):
+        write_qfx(qfx_path + '.tmp', synthetic_transactions(size, seed))
+        os.replace(qfx_path + '.tmp', qfx_path)
+
+    if not os.path.exists(db_path):
+        db = transaction_db.TransactionDb(db_path + '.tmp')
+        setup_ledger(db)
+        db.import_transactions(ACCOUNT, synthetic_transactions(size, seed))
+        db.close_database()
+        os.replace(db_path + '.tmp', db_path)
+
+    return qfx_path, db_path
+
+def copy_ledger(db_path, scratch):
+    path = os.path.join(scratch, 'ledger.db')
+    shutil.copyfile(db_path, path)
+    return path
+
+def bench_import(qfx_path, db_path, scratch):
+    # Parse the statement and write it into an empty ledger
+    db = transaction_db.TransactionDb(os.path.join(scratch, 'empty.db'))
+    setup_ledger(db)
+    start = time.perf_counter()
+    inserted, skipped = db.import_transactions(ACCOUNT, quicken.import_quicken_transactions(qfx_path))
+    seconds = time.perf_counter() - start
+    db.close_database()
+    return seconds, inserted
+
+def bench_dedupe(qfx_path, db_path, scratch):
+    # Import the statement again into the ledger that already holds it, every row is a duplicate
+    db = transaction_db.TransactionDb(copy_ledger(db_path, scratch))
+    start = time.perf_counter()
+    inserted, skipped = db.import_transactions(ACCOUNT, quicken.import_quicken_transactions(qfx_path))
+    seconds = time.perf_counter() - start
+    db.close_database()
+    return seconds, skipped
+
+def bench_add(qfx_path, db_path, scratch):
+    # One add_transaction call, and so one commit, per row
+    db = transaction_db.TransactionDb(copy_ledger(db_path, scratch))
+    rows = list(synthetic_transactions(ADD_COUNT, seed=9999))
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        for trans in rows:
+            db.add_transaction(ACCOUNT, trans.vendor, trans.amount, 'dining', trans.memo, trans.date, trans.fitid)
+    seconds = time.perf_counter() - start
+    db.close_database()
+    return seconds, ADD_COUNT
+
+def bench_recalc(qfx_path, db_path, scratch):
+    # Throw every cached balance off and let recalculate_category_balances find and fix them
+    db = transaction_db.TransactionDb(copy_ledger(db_path, scratch))
+    db.cursor.execute('UPDATE categories SET balance = 0')
+    db.conn.commit()
+    start = time.perf_counter()
+    db.recalculate_category_balances()
+    seconds = time.perf_counter() - start
+    db.cursor.execute('SELECT COUNT(*) FROM transactions')
+    rows = db.cursor.fetchone()[0]
+    db.close_database()
+    return seconds, rows
+
+def bench_listing(qfx_path, db_path, scratch):
+    # Page through the whole ledger the way display_transactions does
+    db = transaction_db.TransactionDb(db_path)
+    rows = 0
+    start = time.perf_counter()
+    for page in db.iter_transactions(PAGE_SIZE):
+        rows += len(page)
+    seconds = time.perf_counter() - start
+    db.close_database()
+    return seconds, rows
+
+def bench_query(qfx_path, db_path, scratch):
+    # A dashboard-style query repeated over consecutive months
+    db = transaction_db.TransactionDb(db_path)
+    rows = 0
+    start = time.perf_counter()
+    month = date(2015, 1, 1)
+    for _ in range(120):
+        next_month = (month + timedelta(days=32)).replace(day=1)
+        rows += len(db.query().categories('groceries', 'dining').dates(month, next_month - timedelta(days=1))
+                    .order_by('-amount').limit(20).all())
+        month = next_month
+    seconds = time.perf_counter() - start
+    db.close_database()
+    return seconds, rows
+
+def bench_remove_category(qfx_path, db_path, scratch):
+    # Remove the category holding about a fifth of the ledger, its rows move to uncategorized
+    db = transaction_db.TransactionDb(copy_ledger(db_path, scratch))
+    db.cursor.execute('SELECT COUNT(*) FROM transaction_details WHERE category = ?', ('groceries',))
+    rows = db.cursor.fetchone()[0]
+    start = time.perf_counter()
+    db.remove_category('groceries')
+    seconds = time.perf_counter() - start
+    db.close_database()
+    return seconds, rows
+
+BENCHMARKS = {
+    'import': bench_import,
+    'dedupe': bench_dedupe,
+    'add': bench_add,
+    'recalc': bench_recalc,
+    'listing': bench_listing,
+    'query': bench_query,
+    'remove_category': bench_remove_category,
+}
+
+def run_case(case, qfx_path, db_path):
+    # Runs in a fresh process; ru_maxrss is in KiB on Linux and bytes on macOS
+    scratch = tempfile.mkdtemp(prefix='budget-bench-')
+    try:
+        seconds, rows = BENCHMARKS[case](qfx_path, db_path, scratch)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024
+
+    return seconds, rows, peak
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the budget app's main operations on synthetic ledgers.")
+    parser.add_argument('--sizes', default='10k,100k,1m', help="comma-separated ledger sizes (default: 10k,100k,1m)")
+    parser.add_argument('--cases', default=','.join(CASES), help=f"comma-separated subset of {', '.join(CASES)}")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help="runs per case, the fastest is reported")
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'budget-bench'),
+                        help="where generated statements and ledgers are kept between runs")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    sizes = [parse_size(size) for size in args.sizes.split(',')]
+    cases = [case.strip() for case in args.cases.split(',')]
+    for case in cases:
+        if case not in BENCHMARKS:
+            parser.error(f"unknown case {case}")
+
+    os.makedirs(args.workdir, exist_ok=True)
+
+    report = {
+        'revision': git_revision(),
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'schema_version': transaction_db.SCHEMA_VERSION,
+        'results': [],
+    }
+
+    context = multiprocessing.get_context('spawn')
+
+    for size in sizes:
+        print(f"Generating {size} transactions in {args.workdir} ...", file=sys.stderr)
+        start = time.perf_counter()
+        qfx_path, db_path = generate_fixtures(args.workdir, size, args.seed)
+        print(f"  ready in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+        for case in cases:
+            runs = []
+            for _ in range(args.repeat):
+                with context.Pool(1) as pool:
+                    runs.append(pool.apply(run_case, (case, qfx_path, db_path)))
+
+            seconds, rows, peak = min(runs)
+            report['results'].append({
+                'case': case,
+                'size': size,
+                'rows': rows,
+                'seconds': round(seconds, 6),
+                'rows_per_second': round(rows / seconds, 1) if seconds else None,
+                'peak_rss_kib': max(run[2] for run in runs),
+            })
+            print(f"  {case:<16} {rows:>9} rows  {seconds:9.3f}s  {peak / 1024:8.1f} MiB", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(output + '\n')
+    else:
+        print(output)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,12 @@
+import argparse
+import sys
 import transaction_db
 import datetime
-from decimal import Decimal
-import quicken
+from contextlib import redirect_stdout
+from decimal import Decimal, InvalidOperation
 
-trans = transaction_db.TransactionDb()
+# Database used by the interactive prompts, opened by main()
+trans = None
 
 def prompt_account_name():
     # Display existing categories and prompt for selection
@@ -34,13 +37,51 @@ def prompt_input_file():
         print("Please enter a valid account.")
         return
 
+    # The parser pulls in ElementTree, so only load it when importing
+    import quicken
+
     all_import_trans = quicken.import_quicken_transactions(file_path)
-    for import_trans in all_import_trans:
-        print("----------------------------------------------------")
-        print(f"vendor: {import_trans.vendor}, amount: {float(import_trans.amount)}, memo: {import_trans.memo}")
-        print("----------------------------------------------------")
-        trans.add_transaction(account_name, import_trans.vendor, import_trans.amount, import_trans.category, import_trans.memo, import_trans.date)
+    inserted, skipped = trans.import_transactions(account_name, all_import_trans)
+
+    print("----------------------------------------------------")
+    print(f"Imported {inserted} transactions, skipped {skipped} duplicates")
+    print("----------------------------------------------------")
+
+def prompt_import_directory():
+    pattern = input("Directory or glob of Quicken files to import: ")
+
+    import quicken
+
+    reports = quicken.import_quicken_files(trans, pattern)
+    if not reports:
+        print("No .qfx/.ofx files found.")
+        return
+
+    print("----------------------------------------------------")
+    for report in reports:
+        if report['error']:
+            print(f"{report['file']}: {report['error']}")
+        else:
+            print(f"{report['file']} -> {report['account']}: imported {report['inserted']}, "
+                  f"skipped {report['skipped']} (parse {report['parse_seconds']:.2f}s, "
+                  f"write {report['write_seconds']:.2f}s)")
+    print("----------------------------------------------------")
+
+def prompt_link_account():
+    try:
+        account_name = prompt_account_name()
+    except ValueError:
+        print("Please enter a valid account.")
+        return
+
+    acctid = input("OFX account ID (ACCTID) of the account's statements: ")
+    try:
+        trans.link_account(account_name, acctid)
+    except transaction_db.EntryExistsError:
+        print("That ACCTID is already linked to another account.")
+        return
 
+    print("Account linked successfully.")
 
 def prompt_edit_transaction(transaction_id):
     # Fetch the transaction data
@@ -55,7 +96,8 @@ def prompt_edit_transaction(transaction_id):
     # Display prompt for each field
     print(f"ID: {transaction_id}")
     new_vendor = input(f"Update Vendor? (Press ENTER to leave as \"{old_trans.vendor}\")\n> ")
-    new_amount = Decimal(input(f"Update Amount? (Press ENTER to leave as \"float({old_trans.amount})\")\n> "))
+    new_amount = input(f"Update Amount? (Press ENTER to leave as \"{float(old_trans.amount)}\")\n> ")
+    new_amount = Decimal(new_amount) if new_amount else None
 
     categories = trans.get_categories()
 
@@ -67,17 +109,17 @@ def prompt_edit_transaction(transaction_id):
     new_category = input(f"Update Category? (Press ENTER to leave as \"{old_trans.category}\")\n> ")
 
     # Validate and update the category field
+    new_category_name = None
     if new_category:
         if new_category.isdigit() and int(new_category) in range(1, len(categories) + 1):
-            new_category_name = categories[int(new_category) - 1][0]
-    else:
-        print("Invalid category. Please select a valid category or press ENTER to leave as is.")
-        new_category_name = None
+            new_category_name = categories[int(new_category) - 1]
+        else:
+            print("Invalid category. Please select a valid category or press ENTER to leave as is.")
 
     new_memo = input(f"Update Memo? (Press ENTER to leave as \"{old_trans.memo}\")\n> ")
     new_date = input(f"Update Date? (Press ENTER to leave as \"{old_trans.date}\")\n> ")
 
-    if new_vendor or new_amount or new_category or new_memo or new_date:
+    if new_vendor or new_amount is not None or new_category_name or new_memo or new_date:
         trans.edit_transaction(transaction_id, new_vendor, new_amount, new_category_name, new_memo, new_date)
         print("Transaction updated successfully!")
     else:
@@ -149,7 +191,7 @@ def prompt_add_account(name):
 
 def prompt_remove_category(name):
     try:
-        trans.remove_category(category_name)
+        trans.remove_category(name)
     except transaction_db.EntryExistsError:
         print("Category does not exist.")
         return
@@ -170,49 +212,490 @@ def display_all_categories():
         print("------------------")
 
 
-# Main program loop
-while True:
-    print("\nBudgeting App Menu:")
-    print("1. Add Transaction")
-    print("2. Edit Transaction")
-    print("3. Display Transactions")
-    print("4. Add Category")
-    print("5. Display All Categories")
-    print("6. Remove Category")
-    print("7. Recalculate Category Balances")
-    print("8. Import transactions from Quicken File (.qfx)")
-    print("9. Add account")
-    print("10. Quit")
-
-    choice = input("Enter your choice (1-10): ")
-
-    if choice == '1':
-        prompt_add_transaction()
-    elif choice == '2':
-        transaction_id = input("Enter the ID of the transaction to edit: ")
-        prompt_edit_transaction(transaction_id)
-    elif choice == '3':
-        trans.display_transactions()
-    elif choice == '4':
-        category_name = input("Enter category name: ")
-        prompt_add_category(category_name)
-    elif choice == '5':
-        display_all_categories()
-    elif choice == '6':
-        category_name = input("Enter category name to remove: ")
-        trans.remove_category(category_name)
-    elif choice == '7':
-        trans.recalculate_category_balances()
-        print("Category balances successfuly recalculated")
-    elif choice == '8':
-        prompt_input_file()
-    elif choice == '9':
-        account_name = input("Enter account name: ")
-        prompt_add_account(account_name)
-    elif choice == '10':
-        break
+def run_menu():
+    # Main program loop
+    while True:
+        print("\nBudgeting App Menu:")
+        print("1. Add Transaction")
+        print("2. Edit Transaction")
+        print("3. Display Transactions")
+        print("4. Add Category")
+        print("5. Display All Categories")
+        print("6. Remove Category")
+        print("7. Recalculate Category Balances")
+        print("8. Import transactions from Quicken File (.qfx)")
+        print("9. Add account")
+        print("10. Import all Quicken files from a directory or glob")
+        print("11. Link account to an OFX account ID")
+        print("12. Quit")
+
+        choice = input("Enter your choice (1-12): ")
+
+        if choice == '1':
+            prompt_add_transaction()
+        elif choice == '2':
+            transaction_id = input("Enter the ID of the transaction to edit: ")
+            prompt_edit_transaction(transaction_id)
+        elif choice == '3':
+            trans.display_transactions()
+        elif choice == '4':
+            category_name = input("Enter category name: ")
+            prompt_add_category(category_name)
+        elif choice == '5':
+            display_all_categories()
+        elif choice == '6':
+            category_name = input("Enter category name to remove: ")
+            trans.remove_category(category_name)
+        elif choice == '7':
+            corrected = trans.recalculate_category_balances()
+            print(f"Category balances successfuly recalculated ({len(corrected)} corrected)")
+        elif choice == '8':
+            prompt_input_file()
+        elif choice == '9':
+            account_name = input("Enter account name: ")
+            prompt_add_account(account_name)
+        elif choice == '10':
+            prompt_import_directory()
+        elif choice == '11':
+            prompt_link_account()
+        elif choice == '12':
+            break
+        else:
+            print("Invalid choice. Please try again.")
+
+def emit(rows, columns, output_format):
+    # Write rows (dicts) to stdout as aligned text, JSON or CSV
+    if output_format == 'json':
+        import json
+        json.dump(rows, sys.stdout, default=str, indent=2)
+        sys.stdout.write("\n")
+    elif output_format == 'csv':
+        import csv
+        writer = csv.DictWriter(sys.stdout, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
     else:
-        print("Invalid choice. Please try again.")
+        lines = ["  ".join(columns)]
+        for row in rows:
+            lines.append("  ".join(str(row[column]) for column in columns))
+        sys.stdout.write("\n".join(lines) + "\n")
 
-# Close the database connection
-trans.close_database()
\ No newline at end of file
+def parse_amount(value):
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise argparse.ArgumentTypeError(f"invalid amount: {value}")
+
+def parse_date(value):
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date (expected YYYY-MM-DD): {value}")
+
+TRANSACTION_FIELDS = ['id', 'account', 'vendor', 'amount', 'category', 'memo', 'date']
+
+def cmd_import(db, args):
+    import quicken
+
+    if args.account:
+        # A single statement into a named account
+        if len(args.paths) != 1:
+            print("--account takes exactly one file", file=sys.stderr)
+            return 2
+        inserted, skipped = db.import_transactions(args.account,
+                                                   quicken.import_quicken_transactions(args.paths[0]))
+        reports = [{'file': args.paths[0], 'account': args.account, 'inserted': inserted, 'skipped': skipped,
+                    'error': None}]
+    else:
+        # Directories and globs, routed to accounts by their ACCTID
+        reports = []
+        for pattern in args.paths:
+            reports.extend(quicken.import_quicken_files(db, pattern, args.workers))
+
+    emit(reports, ['file', 'account', 'inserted', 'skipped', 'error'], args.format)
+    return 1 if any(report['error'] for report in reports) else 0
+
+def cmd_add(db, args):
+    # add_transaction reports on stdout, keep that out of machine-readable output
+    with redirect_stdout(sys.stderr):
+        transaction_id = db.add_transaction(args.account, args.vendor, args.amount, args.category, args.memo,
+                                            args.date)
+
+    emit([db.get_transaction(transaction_id)._asdict()], TRANSACTION_FIELDS, args.format)
+    return 0
+
+def cmd_edit(db, args):
+    edited = db.edit_transaction(args.id, args.vendor, args.amount, args.category, args.memo, args.date)
+    emit([edited._asdict()], TRANSACTION_FIELDS, args.format)
+    return 0
+
+def cmd_bulk_edit(db, args):
+    if args.file:
+        # A JSON list of objects holding an "id" plus the fields to change
+        import json
+        with open(args.file) as edits_file:
+            edits = [(edit.pop('id'), edit) for edit in json.load(edits_file)]
+        edited = db.edit_transactions(edits)
+    else:
+        changes = {field: getattr(args, f'set_{field}') for field in transaction_db.EDIT_COLUMNS
+                   if getattr(args, f'set_{field}') is not None}
+        if not changes:
+            print("Nothing to change, use --set-* options or --file", file=sys.stderr)
+            return 2
+
+        # Refuse to edit the whole ledger by accident
+        if not (args.ids or args.account or args.category or args.vendor is not None or args.start or args.end
+                or args.min_amount is not None or args.max_amount is not None):
+            print("Select the transactions to edit with --ids or a filter", file=sys.stderr)
+            return 2
+
+        query = db.query()
+        if args.ids:
+            query = query.ids(*args.ids)
+        if args.account:
+            query = query.accounts(*args.account)
+        if args.category:
+            query = query.categories(*args.category)
+        if args.vendor is not None:
+            query = query.vendor(args.vendor)
+        query = query.dates(args.start, args.end).amounts(args.min_amount, args.max_amount)
+
+        edited = db.edit_matching(query, changes)
+
+    emit([trans._asdict() for trans in edited], TRANSACTION_FIELDS, args.format)
+    return 0
+
+def cmd_list(db, args):
+    rows = []
+    for page in db.iter_transactions(account=args.account, category=args.category, start_date=args.start,
+                                     end_date=args.end, min_amount=args.min_amount, max_amount=args.max_amount):
+        rows.extend(trans._asdict() for trans in page)
+        if args.limit and len(rows) >= args.limit:
+            del rows[args.limit:]
+            break
+
+    emit(rows, TRANSACTION_FIELDS, args.format)
+    return 0
+
+def cmd_search(db, args):
+    rows = db.search(args.query, args.account, (args.start, args.end), args.limit, args.offset)
+    emit([trans._asdict() for trans in rows], TRANSACTION_FIELDS, args.format)
+    return 0
+
+def cmd_balances(db, args):
+    rows = [{'id': id, 'name': name, 'balance': balance} for id, name, balance in db.get_category_balances()]
+    emit(rows, ['id', 'name', 'balance'], args.format)
+    return 0
+
+def cmd_account_balances(db, args):
+    rows = []
+    for id, name, balance in db.get_account_balances():
+        if args.as_of:
+            balance = db.get_account_balance(name, args.as_of)
+        rows.append({'id': id, 'name': name, 'balance': balance})
+    emit(rows, ['id', 'name', 'balance'], args.format)
+    return 0
+
+def cmd_recalc(db, args):
+    rows = [{'id': id, 'name': name, 'cached': cached, 'actual': actual}
+            for id, name, cached, actual in db.recalculate_category_balances()]
+    emit(rows, ['id', 'name', 'cached', 'actual'], args.format)
+    return 0
+
+def cmd_accounts(db, args):
+    if args.add:
+        db.add_account(args.add)
+    if args.remove:
+        db.remove_account(args.remove)
+    if args.link:
+        db.link_account(*args.link)
+
+    emit([{'name': name} for name in db.get_accounts()], ['name'], args.format)
+    return 0
+
+def cmd_categories(db, args):
+    if args.add:
+        db.add_category(args.add)
+    if args.rename:
+        db.rename_category(*args.rename)
+    if args.remove:
+        db.remove_category(args.remove)
+
+    emit([{'name': name} for name in db.get_categories()], ['name'], args.format)
+    return 0
+
+RULE_FIELDS = ['id', 'category', 'vendor', 'memo', 'min_amount', 'max_amount', 'account', 'priority']
+
+def cmd_rules(db, args):
+    if args.add:
+        db.add_rule(args.add, args.vendor, args.memo, args.min_amount, args.max_amount, args.account,
+                    args.priority)
+    if args.remove is not None:
+        db.remove_rule(args.remove)
+
+    emit([dict(zip(RULE_FIELDS, rule)) for rule in db.get_rules()], RULE_FIELDS, args.format)
+    return 0
+
+def cmd_recategorize(db, args):
+    emit([{'moved': db.recategorize(args.only_uncategorized)}], ['moved'], args.format)
+    return 0
+
+def cmd_monthly(db, args):
+    if args.verify:
+        columns = ['account_id', 'category_id', 'month', 'cached', 'actual']
+        rows = [dict(zip(columns, row)) for row in db.verify_monthly_totals()]
+        emit(rows, columns, args.format)
+        return 1 if rows else 0
+
+    if args.rebuild:
+        db.rebuild_monthly_totals()
+
+    if args.by:
+        columns = [args.by, 'total', 'count']
+        rows = db.get_period_totals(args.start, args.end, args.by, args.account, args.category)
+    else:
+        columns = ['month', 'account', 'category', 'total', 'count']
+        rows = db.get_monthly_totals(args.start, args.end, args.account, args.category)
+
+    emit([dict(zip(columns, row)) for row in rows], columns, args.format)
+    return 0
+
+RECONCILE_FIELDS = ['id', 'amount', 'date', 'vendor', 'statement_date', 'statement_vendor', 'days', 'similarity']
+
+def cmd_reconcile(db, args):
+    import quicken
+
+    reconciliation = db.reconcile(args.account, quicken.import_quicken_transactions(args.path), args.tolerance,
+                                  args.min_similarity)
+    emit(reconciliation.rows(), RECONCILE_FIELDS, args.format)
+
+    summary = reconciliation.summary()
+    print(f"{summary['matched']} matched, {summary['unmatched']} to import, {summary['duplicates']} already "
+          f"imported, {summary['unmatched_existing']} unreconciled rows left", file=sys.stderr)
+
+    if args.apply:
+        reconciled, inserted, skipped = db.apply_reconciliation(reconciliation)
+        print(f"Reconciled {reconciled}, imported {inserted}, skipped {skipped}", file=sys.stderr)
+    return 0
+
+def cmd_archive(db, args):
+    if args.year is not None:
+        moved = db.archive_year(args.year, args.path)
+        print(f"Moved {moved} transactions of {args.year} to the archive", file=sys.stderr)
+
+    emit([{'year': year, 'path': path, 'rows': rows} for year, path, rows in db.get_archives()],
+         ['year', 'path', 'rows'], args.format)
+    return 0
+
+def cmd_serve(db, args):
+    import asyncio
+    import server
+
+    # The service opens its own connections, this one stays idle
+    try:
+        asyncio.run(server.serve(args.db, args.host, args.port, args.readers))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Budgeting app. Runs the interactive menu without a command.")
+    parser.add_argument('--db', default='budget_app.db', help="database file (default: budget_app.db)")
+    parser.add_argument('--format', choices=['text', 'json', 'csv'], default='text', help="output format")
+    parser.add_argument('--instrument', action='store_true',
+                        help="print method, SQL and commit timings to stderr on exit")
+    parser.add_argument('--profile', metavar='FILE', help="write cProfile stats for the command to FILE")
+
+    # The global options are also accepted after the command name
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--db', default=argparse.SUPPRESS, help=argparse.SUPPRESS)
+    common.add_argument('--format', choices=['text', 'json', 'csv'], default=argparse.SUPPRESS,
+                        help="output format (default: text)")
+    common.add_argument('--instrument', action='store_true', default=argparse.SUPPRESS, help=argparse.SUPPRESS)
+    common.add_argument('--profile', default=argparse.SUPPRESS, help=argparse.SUPPRESS)
+
+    commands = parser.add_subparsers(dest='command')
+
+    command = commands.add_parser('import', parents=[common], help="import Quicken .qfx/.ofx files")
+    command.add_argument('paths', nargs='+', help="files, directories or globs")
+    command.add_argument('--account', help="account for a single file (default: by the file's ACCTID)")
+    command.add_argument('--workers', type=int, help="parser processes (default: one per CPU)")
+    command.set_defaults(handler=cmd_import)
+
+    command = commands.add_parser('add', parents=[common], help="add a transaction")
+    command.add_argument('--account', required=True)
+    command.add_argument('--vendor', required=True)
+    command.add_argument('--amount', type=parse_amount, required=True)
+    command.add_argument('--category', default='uncategorized')
+    command.add_argument('--memo', default='')
+    command.add_argument('--date', type=parse_date, default=datetime.date.today())
+    command.set_defaults(handler=cmd_add)
+
+    command = commands.add_parser('edit', parents=[common], help="edit a transaction")
+    command.add_argument('id', type=int)
+    command.add_argument('--vendor')
+    command.add_argument('--amount', type=parse_amount)
+    command.add_argument('--category')
+    command.add_argument('--memo')
+    command.add_argument('--date', type=parse_date)
+    command.set_defaults(handler=cmd_edit)
+
+    command = commands.add_parser('bulk-edit', parents=[common],
+                                  help="edit many transactions in one go, by ids, a filter or a JSON file")
+    command.add_argument('--file', help="JSON list of {\"id\": ..., \"<field>\": ...} edits")
+    command.add_argument('--ids', type=lambda value: [int(id) for id in value.split(',')], metavar='ID,ID,...')
+    command.add_argument('--account', action='append')
+    command.add_argument('--category', action='append')
+    command.add_argument('--vendor')
+    command.add_argument('--from', dest='start', type=parse_date)
+    command.add_argument('--to', dest='end', type=parse_date)
+    command.add_argument('--min-amount', type=parse_amount)
+    command.add_argument('--max-amount', type=parse_amount)
+    command.add_argument('--set-vendor')
+    command.add_argument('--set-amount', type=parse_amount)
+    command.add_argument('--set-category')
+    command.add_argument('--set-memo')
+    command.add_argument('--set-date', type=parse_date)
+    command.set_defaults(handler=cmd_bulk_edit)
+
+    command = commands.add_parser('list', parents=[common], help="list transactions")
+    command.add_argument('--account')
+    command.add_argument('--category')
+    command.add_argument('--from', dest='start', type=parse_date)
+    command.add_argument('--to', dest='end', type=parse_date)
+    command.add_argument('--min-amount', type=parse_amount)
+    command.add_argument('--max-amount', type=parse_amount)
+    command.add_argument('--limit', type=int)
+    command.set_defaults(handler=cmd_list)
+
+    command = commands.add_parser('search', parents=[common], help="full-text search of vendors and memos")
+    command.add_argument('query', help="FTS5 query, e.g. 'amazon refund' or 'amaz*'")
+    command.add_argument('--account')
+    command.add_argument('--from', dest='start', type=parse_date)
+    command.add_argument('--to', dest='end', type=parse_date)
+    command.add_argument('--limit', type=int, default=transaction_db.PAGE_SIZE)
+    command.add_argument('--offset', type=int, default=0)
+    command.set_defaults(handler=cmd_search)
+
+    command = commands.add_parser('balances', parents=[common], help="show category balances")
+    command.set_defaults(handler=cmd_balances)
+
+    command = commands.add_parser('account-balances', parents=[common], help="show account balances")
+    command.add_argument('--as-of', type=parse_date, help="balance at the end of this day")
+    command.set_defaults(handler=cmd_account_balances)
+
+    command = commands.add_parser('recalc', parents=[common], help="verify and repair category balances")
+    command.set_defaults(handler=cmd_recalc)
+
+    command = commands.add_parser('accounts', parents=[common], help="list, add, remove or link accounts")
+    command.add_argument('--add', metavar='NAME')
+    command.add_argument('--remove', metavar='NAME')
+    command.add_argument('--link', nargs=2, metavar=('NAME', 'ACCTID'))
+    command.set_defaults(handler=cmd_accounts)
+
+    command = commands.add_parser('categories', parents=[common], help="list, add, rename or remove categories")
+    command.add_argument('--add', metavar='NAME')
+    command.add_argument('--rename', nargs=2, metavar=('OLD', 'NEW'))
+    command.add_argument('--remove', metavar='NAME')
+    command.set_defaults(handler=cmd_categories)
+
+    command = commands.add_parser('rules', parents=[common], help="list, add or remove categorization rules")
+    command.add_argument('--add', metavar='CATEGORY', help="add a rule assigning CATEGORY")
+    command.add_argument('--vendor', help="vendor contains this text")
+    command.add_argument('--memo', help="memo contains this text")
+    command.add_argument('--min-amount', type=parse_amount)
+    command.add_argument('--max-amount', type=parse_amount)
+    command.add_argument('--account')
+    command.add_argument('--priority', type=int, default=0, help="higher priorities are tried first")
+    command.add_argument('--remove', type=int, metavar='ID')
+    command.set_defaults(handler=cmd_rules)
+
+    command = commands.add_parser('recategorize', parents=[common],
+                                  help="apply the categorization rules to existing transactions")
+    command.add_argument('--only-uncategorized', action='store_true')
+    command.set_defaults(handler=cmd_recategorize)
+
+    command = commands.add_parser('monthly', parents=[common], help="monthly totals from the rollup table")
+    command.add_argument('--account')
+    command.add_argument('--category')
+    command.add_argument('--from', dest='start', type=parse_date, help="first month (any day in it)")
+    command.add_argument('--to', dest='end', type=parse_date, help="last month (any day in it)")
+    command.add_argument('--by', choices=['month', 'category', 'account'], help="sum the period by this key")
+    command.add_argument('--rebuild', action='store_true', help="recompute the rollup from the transactions")
+    command.add_argument('--verify', action='store_true', help="report rollup rows that disagree with the transactions")
+    command.set_defaults(handler=cmd_monthly)
+
+    command = commands.add_parser('reconcile', parents=[common],
+                                  help="match a statement against hand-entered transactions")
+    command.add_argument('path', help="Quicken .qfx/.ofx file")
+    command.add_argument('--account', required=True)
+    command.add_argument('--tolerance', type=int, default=3, help="most days between matched dates (default: 3)")
+    command.add_argument('--min-similarity', type=float, default=0.3,
+                         help="least vendor similarity, 0 to 1 (default: 0.3)")
+    command.add_argument('--apply', action='store_true',
+                         help="reconcile the matches and import the rest of the statement")
+    command.set_defaults(handler=cmd_reconcile)
+
+    command = commands.add_parser('archive', parents=[common],
+                                  help="list archived years, or move a closed year into its own file")
+    command.add_argument('year', type=int, nargs='?', help="year to archive, the oldest one left first")
+    command.add_argument('--path', help="archive file (default: next to the database, named after it and the year)")
+    command.set_defaults(handler=cmd_archive)
+
+    command = commands.add_parser('serve', parents=[common], help="serve the ledger over HTTP/JSON")
+    command.add_argument('--host', default='127.0.0.1')
+    command.add_argument('--port', type=int, default=8080)
+    command.add_argument('--readers', type=int, default=4, help="read-only connections (default: 4)")
+    command.set_defaults(handler=cmd_serve)
+
+    return parser
+
+def main(argv=None):
+    global trans
+
+    args = build_parser().parse_args(argv)
+
+    # Opt-in timing of the database methods, SQL and Quicken parsing, summarized on stderr at exit
+    instrumentation = None
+    if args.instrument:
+        import quicken
+        from instrumentation import Instrumentation, QUICKEN_FUNCTIONS
+        instrumentation = Instrumentation()
+        instrumentation.attach(quicken, QUICKEN_FUNCTIONS, 'quicken.')
+        instrumentation.report_at_exit()
+
+    trans = transaction_db.TransactionDb(args.db, instrumentation=instrumentation)
+
+    try:
+        if args.command is None:
+            run_menu()
+            return 0
+
+        if args.profile:
+            import cProfile
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(args.handler, trans, args)
+            finally:
+                profile.dump_stats(args.profile)
+                print(f"Profile written to {args.profile} (python -m pstats {args.profile})", file=sys.stderr)
+
+        return args.handler(trans, args)
+    except transaction_db.EntryExistsError:
+        print("Account or category does not exist, or already exists.", file=sys.stderr)
+        return 1
+    except transaction_db.TransactionExists:
+        print("Transaction already exists.", file=sys.stderr)
+        return 1
+    except IndexError:
+        print("Transaction does not exist.", file=sys.stderr)
+        return 1
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    finally:
+        # Close the database connection
+        trans.close_database()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,190 @@
+import atexit
+import functools
+import inspect
+import re
+import sqlite3
+import sys
+import time
+
+# Opt-in measurements for TransactionDb and quicken:
+#   instrumentation = Instrumentation()
+#   db = TransactionDb(path, instrumentation=instrumentation)
+#   instrumentation.attach(quicken, QUICKEN_FUNCTIONS, 'quicken.')
+#   instrumentation.report_at_exit()
+# Every public TransactionDb method is timed (inclusive of the methods it calls), every statement
+# executed through the connection's cursors is counted and timed, the trace callback counts every
+# statement SQLite actually ran (one per executemany row plus the statements of the triggers they
+# fired), and commits and rollbacks are counted and timed.
+
+QUICKEN_FUNCTIONS = ('import_quicken_transactions', 'read_account_id', 'find_quicken_files',
+                     'import_quicken_files')
+
+# Methods whose return value isn't a list but still says how many rows were processed
+ROW_COUNTERS = {
+    'import_transactions': lambda result: sum(result),
+    'recategorize': lambda result: result,
+    'reconcile': lambda result: len(result.matches),
+    'apply_reconciliation': lambda result: sum(result),
+    'archive_year': lambda result: result,
+}
+
+# Methods that only hand back another object, timing them says nothing
+SKIPPED_METHODS = ('transaction', 'query')
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+class Instrumentation:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+
+        # name -> [calls, seconds, rows]
+        self.methods = {}
+        # normalized SQL -> [executions, seconds, parameter rows]
+        self.statements = {}
+        # raw SQL -> normalized SQL, so repeated statements are only normalized once
+        self._keys = {}
+
+        # Statements reported by the trace callback; sqlite3 passes them with their parameters expanded,
+        # so they are only counted
+        self.traced = 0
+
+        self.commits = 0
+        self.commit_seconds = 0.0
+        self.rollbacks = 0
+
+    def connect(self, *args, **kwargs):
+        # sqlite3.connect returning a connection whose cursors, commits and rollbacks report here
+        conn = sqlite3.connect(*args, factory=InstrumentedConnection, **kwargs)
+        conn.instrumentation = self
+        conn.set_trace_callback(self._trace)
+        return conn
+
+    def _stats(self, sql):
+        key = self._keys.get(sql)
+        if key is None:
+            key = self._keys[sql] = _WHITESPACE_RE.sub(' ', sql).strip()
+        stats = self.statements.get(key)
+        if stats is None:
+            stats = self.statements[key] = [0, 0.0, 0]
+        return stats
+
+    def _trace(self, sql):
+        self.traced += 1
+
+    def record_statement(self, sql, seconds, rows):
+        stats = self._stats(sql)
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] += rows
+
+    def attach(self, target, names=None, prefix=''):
+        # Replace each named function of target (an object or a module) with a timed wrapper;
+        # for objects the default is every public method of its class
+        if names is None:
+            names = [name for name, member in inspect.getmembers(type(target), inspect.isfunction)
+                     if not name.startswith('_') and name not in SKIPPED_METHODS]
+
+        for name in names:
+            setattr(target, name, self._wrap(prefix + name, name, getattr(target, name)))
+
+    def _wrap(self, label, name, function):
+        stats = self.methods.setdefault(label, [0, 0.0, 0])
+        count_rows = ROW_COUNTERS.get(name, lambda result: len(result) if isinstance(result, list) else 0)
+
+        if inspect.isgeneratorfunction(function):
+            # Only the time spent producing items counts, not the consumer's work between them
+            @functools.wraps(function)
+            def generator_wrapper(*args, **kwargs):
+                stats[0] += 1
+                iterator = function(*args, **kwargs)
+                try:
+                    while True:
+                        start = time.perf_counter()
+                        try:
+                            item = next(iterator)
+                        except StopIteration:
+                            return
+                        finally:
+                            stats[1] += time.perf_counter() - start
+                        stats[2] += len(item) if isinstance(item, list) else 1
+                        yield item
+                finally:
+                    iterator.close()
+
+            return generator_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            stats[0] += 1
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                stats[1] += time.perf_counter() - start
+            stats[2] += count_rows(result)
+            return result
+
+        return wrapper
+
+    def report(self, stream=None, limit=20):
+        stream = stream or sys.stderr
+        lines = [f"Instrumentation summary ({time.perf_counter() - self.started:.3f}s elapsed)", ""]
+
+        lines.append(f"{'method':<48} {'calls':>8} {'seconds':>10} {'rows':>10}")
+        for label, (calls, seconds, rows) in sorted(self.methods.items(), key=lambda item: -item[1][1]):
+            if calls:
+                lines.append(f"{label:<48} {calls:>8} {seconds:>10.4f} {rows:>10}")
+
+        totals = [sum(stats[index] for stats in self.statements.values()) for index in range(3)]
+        lines += ["", f"{'statement':<48} {'count':>8} {'seconds':>10} {'rows':>10}"]
+        for sql, (count, seconds, rows) in sorted(self.statements.items(), key=lambda item: -item[1][1])[:limit]:
+            display = sql if len(sql) <= 48 else sql[:45] + '...'
+            lines.append(f"{display:<48} {count:>8} {seconds:>10.4f} {rows:>10}")
+        lines.append(f"{'all statements':<48} {totals[0]:>8} {totals[1]:>10.4f} {totals[2]:>10}")
+        lines.append(f"statements run by SQLite, triggers included: {self.traced}")
+
+        # Each commit is one journal sync with synchronous=full; in WAL mode with synchronous=normal
+        # the syncs happen at checkpoints instead
+        lines += ["", f"commits: {self.commits} ({self.commit_seconds:.4f}s), rollbacks: {self.rollbacks}"]
+
+        stream.write('\n'.join(lines) + '\n')
+
+    def report_at_exit(self, stream=None):
+        atexit.register(self.report, stream)
+
+class InstrumentedCursor(sqlite3.Cursor):
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.connection.instrumentation.record_statement(sql, time.perf_counter() - start, 1)
+
+    def executemany(self, sql, seq_of_parameters):
+        # Materialize the parameters so their number is known, generators included
+        seq_of_parameters = list(seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.connection.instrumentation.record_statement(sql, time.perf_counter() - start,
+                                                             len(seq_of_parameters))
+
+class InstrumentedConnection(sqlite3.Connection):
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            self.instrumentation.commits += 1
+            self.instrumentation.commit_seconds += time.perf_counter() - start
+
+    def rollback(self):
+        self.instrumentation.rollbacks += 1
+        super().rollback()
@@ -1,29 +1,266 @@
+import glob
+import io
+import os
+import re
+import time
 import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from transaction_db import Transaction
 from decimal import Decimal
 from datetime import datetime
 
+# Size of the blocks read from SGML files while streaming
+CHUNK_SIZE = 64 * 1024
+
+_TAG_RE = re.compile(r'(<[^>]*>)')
+_CLOSE_TAG_RE = re.compile(rb'</\s*([^\s>]+)')
+_BARE_AMP_RE = re.compile(r'&(?!(?:amp|lt|gt|quot|apos|#\d+|#x[0-9a-fA-F]+);)')
+
+def _parse_date(date_str):
+    # Strip the fractional seconds and time zone offset if present
+    date_str = date_str.strip().split("[")[0].split(".")[0]
+
+    # Dates are YYYYMMDD optionally followed by HHMMSS; slicing is much cheaper than strptime
+    date_str = date_str.ljust(14, "0")
+
+    return datetime(int(date_str[0:4]), int(date_str[4:6]), int(date_str[6:8]),
+                    int(date_str[8:10]), int(date_str[10:12]), int(date_str[12:14]))
+
+def _read_header(stream):
+    # OFX 1.x files start with "KEY:VALUE" lines before the first tag
+    header = {}
+    line = stream.readline()
+    while line and b'<' not in line:
+        key, sep, value = line.decode('ascii', 'replace').strip().partition(':')
+        if sep:
+            header[key] = value
+        line = stream.readline()
+
+    return header, line
+
+def _closed_tags(stream):
+    # Names of the elements the file closes explicitly, i.e. the aggregates; read from the current
+    # position to the end
+    names = set()
+    carry = b''
+    while True:
+        block = stream.read(CHUNK_SIZE)
+        if not block:
+            names.update(_CLOSE_TAG_RE.findall(carry))
+            return {name.decode('ascii', 'replace') for name in names}
+
+        text = carry + block
+        cut = text.rfind(b'<')
+        text, carry = (text[:cut], text[cut:]) if cut > 0 else (text, b'')
+        names.update(_CLOSE_TAG_RE.findall(text))
+
+def _sgml_to_xml(stream, closed=None):
+    # OFX 1.x leaves leaf elements such as <TRNAMT>-12.50 unclosed; close them as the text streams by.
+    # A start tag without a value, such as a bare <MEMO>, is a leaf when its name isn't in closed (the
+    # names the file does close) and is closed on the spot; without closed, such tags are left open.
+    last_start = None
+    open_leaf = None
+    carry = ''
+
+    while True:
+        block = stream.read(CHUNK_SIZE)
+        text = carry + block
+
+        # Only hand over text up to the last tag start so no tag is split across blocks
+        if block:
+            cut = text.rfind('<')
+            if cut <= 0:
+                carry = text
+                continue
+            text, carry = text[:cut], text[cut:]
+
+        out = []
+        for token in _TAG_RE.split(text):
+            if not token:
+                continue
+
+            if token.startswith('<'):
+                # Drop processing instructions and declarations
+                if token.startswith('<?') or token.startswith('<!'):
+                    continue
+
+                closing = token.startswith('</')
+                name = token.strip('</>').split()[0] if token.strip('</>') else ''
+
+                # A start tag followed straight by another tag is an empty leaf unless the file closes it
+                empty_leaf = last_start and closed is not None and last_start not in closed
+                if open_leaf and not (closing and name == open_leaf):
+                    out.append(f'</{open_leaf}>')
+                elif empty_leaf and not (closing and name == last_start):
+                    out.append(f'</{last_start}>')
+
+                open_leaf = None
+                last_start = None if closing else name
+                out.append(token)
+            else:
+                if last_start and token.strip():
+                    open_leaf = last_start
+                    last_start = None
+                    token = token.strip()
+                elif last_start and closed is not None and last_start not in closed:
+                    # Only whitespace before the next tag, the leaf is empty
+                    out.append(f'</{last_start}>')
+                    last_start = None
+                out.append(_BARE_AMP_RE.sub('&amp;', token))
+
+        if not block:
+            if open_leaf:
+                out.append(f'</{open_leaf}>')
+            elif last_start and closed is not None and last_start not in closed:
+                out.append(f'</{last_start}>')
+            yield ''.join(out)
+            return
+
+        yield ''.join(out)
+
+class _ChainedReader:
+
+    def __init__(self, *streams):
+        self.streams = list(streams)
+
+    def read(self, size):
+        while self.streams:
+            data = self.streams[0].read(size)
+            if data:
+                return data
+            self.streams.pop(0)
+        return ''
+
+def _iter_events(file_path):
+    with open(file_path, 'rb') as stream:
+        header, first_line = _read_header(stream)
+
+        # Plain XML files can go straight to iterparse
+        if not header:
+            stream.seek(0)
+            yield from ET.iterparse(stream, events=('start', 'end'))
+            return
+
+        # One quick pass for the names of the aggregates, so empty leaves can be told from them
+        position = stream.tell()
+        closed = _closed_tags(stream) | {name.decode('ascii', 'replace')
+                                         for name in _CLOSE_TAG_RE.findall(first_line)}
+        stream.seek(position)
+
+        encoding = 'cp1252' if header.get('CHARSET') == '1252' else 'utf-8'
+        text = io.TextIOWrapper(stream, encoding=encoding, errors='replace')
+
+        # Feed the normalized SGML through an incremental parser, starting at the first tag
+        first_line = first_line.decode(encoding, 'replace')
+        source = io.StringIO(first_line[first_line.find('<'):])
+
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        for chunk in _sgml_to_xml(_ChainedReader(source, text), closed):
+            parser.feed(chunk)
+            yield from parser.read_events()
+
+        parser.close()
+        yield from parser.read_events()
+
 def import_quicken_transactions(file_path):
-    tree = ET.parse(file_path)
-    root = tree.getroot()
+    # Elements opened but not yet finished, so finished transactions can be detached from their parent
+    stack = []
+
+    for event, elem in _iter_events(file_path):
+
+        if event == 'start':
+            stack.append(elem)
+            continue
+
+        stack.pop()
+
+        if elem.tag != "STMTTRN":
+            continue
+
+        trans = Transaction(
+            id=None,
+            vendor=str(elem.findtext("NAME")),
+            amount=Decimal(str(elem.findtext("TRNAMT")).strip()),
+            category="uncategorized",
+            memo=str(elem.findtext("MEMO")),
+            date=_parse_date(elem.findtext("DTPOSTED")),
+            fitid=(elem.findtext("FITID") or "").strip() or None,
+        )
+
+        # Release the parsed element so memory stays flat over the file
+        elem.clear()
+        if stack:
+            stack[-1].remove(elem)
+
+        yield trans
+
+def read_account_id(file_path):
+    # The statement's ACCTID comes before its transaction list, so stop at the first one
+    for event, elem in _iter_events(file_path):
+        if event == 'end' and elem.tag == 'ACCTID':
+            return (elem.text or '').strip() or None
+    return None
+
+def find_quicken_files(pattern):
+    # A directory means every .qfx/.ofx file in it, anything else is treated as a glob
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*')
+    return sorted(path for path in glob.glob(pattern)
+                  if os.path.splitext(path)[1].lower() in ('.qfx', '.ofx'))
+
+def _parse_file(file_path):
+    # Runs in a worker process: parse a whole statement and time it
+    start = time.perf_counter()
+    try:
+        account_id = read_account_id(file_path)
+        transactions = list(import_quicken_transactions(file_path))
+    except (ET.ParseError, ValueError, ArithmeticError, OSError) as error:
+        return file_path, None, None, time.perf_counter() - start, str(error)
+
+    return file_path, account_id, transactions, time.perf_counter() - start, None
+
+def import_quicken_files(db, pattern, workers=None):
+    # Parse every statement matching pattern in a process pool and write them all from this
+    # process in a single unit of work. Each file goes to the account linked to its ACCTID;
+    # rerunning the same files only skips duplicates thanks to the fingerprint index.
+    # Returns one report dict per file.
+    files = find_quicken_files(pattern)
+    reports = []
 
-    transactions = []
+    if not files:
+        return reports
 
-    for stmttrn in root.findall(".//STMTTRN"):
+    with ProcessPoolExecutor(max_workers=workers) as pool, db.transaction():
+        futures = [pool.submit(_parse_file, file_path) for file_path in files]
 
-        trans = Transaction()
+        # Write each statement as soon as its worker is done with it
+        for future in as_completed(futures):
+            file_path, acctid, transactions, parse_seconds, error = future.result()
+            report = {
+                'file': file_path,
+                'acctid': acctid,
+                'account': None,
+                'parsed': len(transactions) if transactions is not None else 0,
+                'inserted': 0,
+                'skipped': 0,
+                'parse_seconds': parse_seconds,
+                'write_seconds': 0.0,
+                'error': error,
+            }
+            reports.append(report)
 
-        date_str = date_str = stmttrn.findtext("DTPOSTED")
-        # Strip the time zone offset if present
-        date_str = date_str.split(".")[0]
+            if error:
+                continue
 
-        trans.id = None
-        trans.vendor = str(stmttrn.findtext("NAME"))
-        trans.amount = Decimal(str(stmttrn.findtext("TRNAMT")))
-        trans.category = "uncategorized"
-        trans.memo = str(stmttrn.findtext("MEMO"))
-        trans.date = datetime.strptime(date_str, "%Y%m%d%H%M%S")
+            account = db.get_account_for_ofx_id(acctid) if acctid else None
+            if account is None:
+                report['error'] = f"No account linked to ACCTID {acctid}"
+                continue
 
-        transactions.append(trans)
+            start = time.perf_counter()
+            report['account'] = account
+            report['inserted'], report['skipped'] = db.import_transactions(account, transactions)
+            report['write_seconds'] = time.perf_counter() - start
 
-    return transactions
+    reports.sort(key=lambda report: report['file'])
+    return reports
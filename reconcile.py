@@ -0,0 +1,106 @@
+from collections import namedtuple
+from difflib import SequenceMatcher
+
+# A statement record paired with an existing, hand-entered transaction of the same account and amount
+Match = namedtuple('Match', 'statement existing days similarity score')
+
+# How much each day between the two dates costs a candidate's score
+DAY_PENALTY = 0.1
+
+def _normalize(value):
+    return ' '.join(str(value if value is not None else '').lower().split())
+
+def vendor_similarity(a, b):
+    # 1.0 when one vendor string contains the other ('amazon' vs 'amazon mktplace pmts'),
+    # otherwise difflib's ratio of the normalized strings
+    a = _normalize(a)
+    b = _normalize(b)
+    if not a or not b:
+        return 0.0
+    if a in b or b in a:
+        return 1.0
+    return SequenceMatcher(None, a, b).ratio()
+
+def _key(trans):
+    # Cents and day number so records only compare equal on the exact amount
+    return (str(trans.account).lower(), int(round(trans.amount * 100)), trans.date.toordinal())
+
+def match_transactions(statement, existing, date_tolerance=3, min_similarity=0.3):
+    # Pair statement records with existing transactions of the same account and amount dated at most
+    # date_tolerance days apart whose vendors are at least min_similarity alike. Both sides are sorted
+    # by (account, amount, day) and merged with a sliding window, so only nearby rows are ever compared;
+    # the candidates are then assigned one-to-one, best score first.
+    # Returns (matches, unmatched statement records, unmatched existing transactions).
+    statement_keys = sorted((_key(trans), index) for index, trans in enumerate(statement))
+    existing_keys = sorted((_key(trans), index) for index, trans in enumerate(existing))
+
+    candidates = []
+    low = 0
+    for (account, amount, day), statement_index in statement_keys:
+        # Skip existing rows that sort before this record's window; later records only move it forward
+        while low < len(existing_keys) and existing_keys[low][0] < (account, amount, day - date_tolerance):
+            low += 1
+
+        position = low
+        while position < len(existing_keys) and existing_keys[position][0] <= (account, amount, day + date_tolerance):
+            existing_index = existing_keys[position][1]
+            similarity = vendor_similarity(statement[statement_index].vendor, existing[existing_index].vendor)
+            if similarity >= min_similarity:
+                days = abs(existing_keys[position][0][2] - day)
+                candidates.append((similarity - DAY_PENALTY * days, days, statement_index, existing_index,
+                                   similarity))
+            position += 1
+
+    # Best pairs first; ties go to the closest dates, then to the earliest rows on either side
+    candidates.sort(key=lambda candidate: (-candidate[0], candidate[1], candidate[2], candidate[3]))
+
+    matches = []
+    matched_statement = set()
+    matched_existing = set()
+    for score, days, statement_index, existing_index, similarity in candidates:
+        if statement_index in matched_statement or existing_index in matched_existing:
+            continue
+        matched_statement.add(statement_index)
+        matched_existing.add(existing_index)
+        matches.append(Match(statement[statement_index], existing[existing_index], days, similarity, score))
+
+    matches.sort(key=lambda match: (match.statement.date, match.existing.id))
+    return (matches,
+            [trans for index, trans in enumerate(statement) if index not in matched_statement],
+            [trans for index, trans in enumerate(existing) if index not in matched_existing])
+
+class Reconciliation:
+    # Result of TransactionDb.reconcile, to be reviewed and then passed to apply_reconciliation
+
+    def __init__(self, account, matches, unmatched, duplicates, unmatched_existing):
+        self.account = account
+        # Match records, existing rows that will take over the statement's details
+        self.matches = matches
+        # Statement records with no counterpart, imported by apply_reconciliation
+        self.unmatched = unmatched
+        # Statement records already in the ledger exactly, skipped
+        self.duplicates = duplicates
+        # Hand-entered rows in the statement's period that nothing matched
+        self.unmatched_existing = unmatched_existing
+
+    def rows(self):
+        # One dict per match, for display or export
+        return [{
+            'id': match.existing.id,
+            'amount': match.existing.amount,
+            'date': match.existing.date,
+            'vendor': match.existing.vendor,
+            'statement_date': match.statement.date,
+            'statement_vendor': match.statement.vendor,
+            'days': match.days,
+            'similarity': round(match.similarity, 3),
+        } for match in self.matches]
+
+    def summary(self):
+        return {
+            'account': self.account,
+            'matched': len(self.matches),
+            'unmatched': len(self.unmatched),
+            'duplicates': len(self.duplicates),
+            'unmatched_existing': len(self.unmatched_existing),
+        }
@@ -0,0 +1,101 @@
+from collections import namedtuple
+
+# A categorization rule as stored in category_rules; amounts are in cents and every
+# condition left as None matches anything
+Rule = namedtuple('Rule', 'id category_id vendor memo min_amount max_amount account_id priority')
+
+class AhoCorasick:
+
+    def __init__(self, patterns):
+        # Trie over the lowercased patterns, patterns is a list of (key, substring)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        for key, pattern in patterns:
+            state = 0
+            for char in pattern.lower():
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].append(key)
+
+        # Breadth-first pass to link every state to its longest proper suffix in the trie
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                if self.fail[next_state] == next_state:
+                    self.fail[next_state] = 0
+
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def search(self, text):
+        # Keys of every pattern occurring anywhere in text, in a single pass over it
+        found = set()
+        state = 0
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+
+        return found
+
+class RuleMatcher:
+
+    def __init__(self, rules):
+        # Highest priority first, oldest rule first among equals
+        self.rules = sorted(rules, key=lambda rule: (-rule.priority, rule.id))
+        self.rank = {rule.id: index for index, rule in enumerate(self.rules)}
+
+        self.vendors = AhoCorasick([(rule.id, rule.vendor) for rule in self.rules if rule.vendor])
+        self.memos = AhoCorasick([(rule.id, rule.memo) for rule in self.rules if rule.memo])
+
+        # Rules without a vendor pattern have to be checked for every transaction
+        self.unanchored = [rule.id for rule in self.rules if not rule.vendor]
+        self.by_id = {rule.id: rule for rule in self.rules}
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def match(self, vendor, memo, amount, account_id):
+        # Category id of the best rule matching the transaction (amount in cents), or None
+        candidates = self.vendors.search(vendor or '')
+        candidates.update(self.unanchored)
+        if not candidates:
+            return None
+
+        memo_matches = None
+
+        for rule_id in sorted(candidates, key=self.rank.__getitem__):
+            rule = self.by_id[rule_id]
+
+            if rule.account_id is not None and rule.account_id != account_id:
+                continue
+            if rule.min_amount is not None and amount < rule.min_amount:
+                continue
+            if rule.max_amount is not None and amount > rule.max_amount:
+                continue
+            if rule.memo:
+                if memo_matches is None:
+                    memo_matches = self.memos.search(memo or '')
+                if rule.id not in memo_matches:
+                    continue
+
+            return rule.category_id
+
+        return None
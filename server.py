@@ -0,0 +1,443 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from decimal import Decimal
+from functools import partial
+from urllib.parse import parse_qs, urlsplit
+
+import transaction_db
+from transaction_db import EntryExistsError, Transaction, TransactionExists
+
+# Local HTTP/JSON service over a ledger file:
+#   GET  /transactions?account=&category=&from=&to=&min_amount=&max_amount=&limit=&offset=
+#   GET  /search?q=&account=&from=&to=&limit=&offset=
+#   GET  /balances
+#   GET  /metrics
+#   POST /transactions   {"account", "vendor", "amount", "category", "memo", "date", "fitid"}
+#   POST /import?account=   body is a QFX/OFX statement, routed by its ACCTID without account
+#
+# Every SQLite connection lives on its own thread: reads go to a pool of read-only connections,
+# all writes go through one writer thread whose work queue serializes them, and inserts arriving
+# close together are written in one transaction.
+
+MAX_BODY = 64 * 1024 * 1024
+
+# Latencies kept per endpoint for the percentiles in /metrics
+LATENCY_WINDOW = 1000
+
+class HttpError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+REASONS = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           409: 'Conflict', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+def _json_default(value):
+    # Decimal amounts keep their exact text, dates their ISO form
+    if isinstance(value, (Decimal, date)):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def _single(params, name, convert=str, default=None):
+    values = params.get(name)
+    if not values:
+        return default
+    try:
+        return convert(values[-1])
+    except (ValueError, ArithmeticError):
+        raise HttpError(400, f"Invalid value for {name}: {values[-1]}")
+
+def _iso_date(value):
+    return date.fromisoformat(value[:10])
+
+class Connection:
+    # A TransactionDb bound to the single thread allowed to use it
+
+    def __init__(self, executor, db):
+        self.executor = executor
+        self.db = db
+
+    @classmethod
+    async def open(cls, path, **kwargs):
+        executor = ThreadPoolExecutor(max_workers=1)
+        db = await asyncio.get_running_loop().run_in_executor(
+            executor, partial(transaction_db.TransactionDb, path, **kwargs))
+        return cls(executor, db)
+
+    async def run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, self.db, *args)
+
+    async def close(self):
+        await self.run(transaction_db.TransactionDb.close_database)
+        self.executor.shutdown()
+
+class Endpoint:
+    # Request counters and recent latencies of one route
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.recent = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, seconds, failed):
+        self.requests += 1
+        self.errors += failed
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.recent.append(seconds)
+
+    def summary(self):
+        recent = sorted(self.recent)
+
+        def percentile(fraction):
+            return round(recent[min(len(recent) - 1, int(fraction * len(recent)))] * 1000, 3) if recent else None
+
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'mean_ms': round(self.total_seconds / self.requests * 1000, 3) if self.requests else None,
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99),
+            'max_ms': round(self.max_seconds * 1000, 3),
+        }
+
+class LedgerServer:
+
+    def __init__(self, path, host='127.0.0.1', port=8080, readers=4, batch_size=500, batch_delay=0.002):
+        self.path = path
+        self.host = host
+        self.port = port
+        self.reader_count = readers
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+
+        self.writer = None
+        self.readers = None
+        self.server = None
+
+        # Inserts waiting for the next batch, as (Transaction, future) pairs
+        self.pending = []
+        self.flush_handle = None
+        self.batches = 0
+        self.batched_inserts = 0
+
+        self.routes = {
+            ('GET', '/transactions'): self.list_transactions,
+            ('GET', '/search'): self.search,
+            ('GET', '/balances'): self.balances,
+            ('GET', '/metrics'): self.metrics,
+            ('POST', '/transactions'): self.add_transaction,
+            ('POST', '/import'): self.import_statement,
+        }
+        self.endpoints = {f'{method} {path}': Endpoint() for method, path in self.routes}
+
+    async def start(self):
+        # The writer opens first so the schema exists before the read-only connections look at it
+        self.writer = await Connection.open(self.path)
+        self.readers = asyncio.Queue()
+        for _ in range(self.reader_count):
+            self.readers.put_nowait(await Connection.open(self.path, read_only=True))
+
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        # Port 0 picks a free port, report the real one
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+        if self.pending:
+            await self.flush()
+
+        while not self.readers.empty():
+            await self.readers.get_nowait().close()
+        await self.writer.close()
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def read(self, function, *args):
+        # Run function(db, *args) on whichever read-only connection is free
+        connection = await self.readers.get()
+        try:
+            return await connection.run(function, *args)
+        finally:
+            self.readers.put_nowait(connection)
+
+    async def write(self, function, *args):
+        return await self.writer.run(function, *args)
+
+    # Insert batching
+
+    def queue_insert(self, trans):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((trans, future))
+
+        # Write as soon as a batch is full, otherwise give concurrent requests batch_delay to join in
+        if len(self.pending) >= self.batch_size:
+            asyncio.ensure_future(self.flush())
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(
+                self.batch_delay, lambda: asyncio.ensure_future(self.flush()))
+
+        return future
+
+    async def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+
+        self.batches += 1
+        self.batched_inserts += len(batch)
+
+        try:
+            results = await self.write(_insert_batch, [trans for trans, future in batch])
+        except Exception as error:
+            results = [error] * len(batch)
+
+        for (trans, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    # Endpoints, each returns (status, payload)
+
+    async def list_transactions(self, params, body):
+        def run(db):
+            query = db.query()
+            if 'account' in params:
+                query = query.accounts(*params['account'])
+            if 'category' in params:
+                query = query.categories(*params['category'])
+            query = query.dates(_single(params, 'from', _iso_date), _single(params, 'to', _iso_date))
+            query = query.amounts(_single(params, 'min_amount', Decimal), _single(params, 'max_amount', Decimal))
+            query = query.limit(_single(params, 'limit', int, transaction_db.PAGE_SIZE),
+                                _single(params, 'offset', int, 0))
+            return [trans._asdict() for trans in query.all()]
+
+        return 200, {'transactions': await self.read(run)}
+
+    async def search(self, params, body):
+        query = _single(params, 'q')
+        if not query:
+            raise HttpError(400, "Missing q")
+
+        def run(db):
+            date_range = (_single(params, 'from', _iso_date), _single(params, 'to', _iso_date))
+            return [trans._asdict() for trans in
+                    db.search(query, _single(params, 'account'), date_range,
+                              _single(params, 'limit', int, transaction_db.PAGE_SIZE),
+                              _single(params, 'offset', int, 0))]
+
+        return 200, {'transactions': await self.read(run)}
+
+    async def balances(self, params, body):
+        def run(db):
+            return [{'id': id, 'name': name, 'balance': balance} for id, name, balance in db.get_category_balances()]
+
+        return 200, {'balances': await self.read(run)}
+
+    async def metrics(self, params, body):
+        return 200, {
+            'endpoints': {name: endpoint.summary() for name, endpoint in self.endpoints.items()},
+            'insert_batches': self.batches,
+            'batched_inserts': self.batched_inserts,
+            'readers': self.reader_count,
+        }
+
+    async def add_transaction(self, params, body):
+        try:
+            fields = json.loads(body or b'{}')
+            trans = Transaction(
+                account=str(fields['account']),
+                vendor=str(fields.get('vendor', '')),
+                amount=Decimal(str(fields['amount'])),
+                category=str(fields.get('category', 'uncategorized')),
+                memo=str(fields.get('memo', '')),
+                date=_iso_date(str(fields['date'])) if fields.get('date') else date.today(),
+                fitid=str(fields['fitid']) if fields.get('fitid') else None,
+            )
+        except KeyError as error:
+            raise HttpError(400, f"Missing field {error.args[0]}")
+        except (ValueError, ArithmeticError, TypeError, AttributeError) as error:
+            raise HttpError(400, f"Invalid transaction: {error}")
+
+        transaction_id = await self.queue_insert(trans)
+        return 201, {'id': transaction_id}
+
+    async def import_statement(self, params, body):
+        import quicken
+
+        if not body:
+            raise HttpError(400, "Empty statement")
+
+        # The parser works on files, so the upload is spooled to a temporary one and parsed off the loop
+        handle, path = tempfile.mkstemp(suffix='.qfx')
+        try:
+            with os.fdopen(handle, 'wb') as statement:
+                statement.write(body)
+
+            def parse():
+                return quicken.read_account_id(path), list(quicken.import_quicken_transactions(path))
+
+            try:
+                acctid, transactions = await asyncio.get_running_loop().run_in_executor(None, parse)
+            except Exception as error:
+                raise HttpError(400, f"Unreadable statement: {error}")
+        finally:
+            os.remove(path)
+
+        account = _single(params, 'account')
+        if account is None:
+            account = await self.read(transaction_db.TransactionDb.get_account_for_ofx_id, acctid)
+            if account is None:
+                raise HttpError(404, f"No account linked to ACCTID {acctid}")
+
+        inserted, skipped = await self.write(transaction_db.TransactionDb.import_transactions, account, transactions)
+        return 200, {'account': account, 'acctid': acctid, 'inserted': inserted, 'skipped': skipped}
+
+    # HTTP
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except HttpError as error:
+                    # The rest of the stream can't be trusted to start at a request, answer and hang up
+                    await _write_response(writer, error.status, {'error': str(error)}, False)
+                    break
+                if request is None:
+                    break
+                method, target, headers, body = request
+
+                start = time.perf_counter()
+                url = urlsplit(target)
+                handler = self.routes.get((method, url.path))
+                endpoint = self.endpoints.get(f'{method} {url.path}')
+
+                try:
+                    if handler is None:
+                        if any(path == url.path for _, path in self.routes):
+                            raise HttpError(405, f"{method} not allowed on {url.path}")
+                        raise HttpError(404, f"No route for {url.path}")
+                    status, payload = await handler(parse_qs(url.query), body)
+                except HttpError as error:
+                    status, payload = error.status, {'error': str(error)}
+                except EntryExistsError:
+                    status, payload = 404, {'error': "Unknown account or category"}
+                except TransactionExists:
+                    status, payload = 409, {'error': "Transaction already exists"}
+                except ValueError as error:
+                    status, payload = 400, {'error': str(error)}
+                except Exception as error:
+                    status, payload = 500, {'error': f"{type(error).__name__}: {error}"}
+
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await _write_response(writer, status, payload, keep_alive)
+
+                if endpoint is not None:
+                    endpoint.record(time.perf_counter() - start, status >= 400)
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+def _insert_batch(db, transactions):
+    # Runs on the writer thread: one transaction for the whole batch, with a result per record -
+    # its id, or the exception that record would have raised on its own
+    accounts = set(db.get_accounts())
+    categories = set(db.get_categories())
+    archived_until = db._archived_until()
+
+    results = [None] * len(transactions)
+    valid = []
+    for index, trans in enumerate(transactions):
+        if trans.account.lower() not in accounts or trans.category.lower() not in categories:
+            results[index] = EntryExistsError()
+            continue
+
+        # A record dated in an archived year fails on its own instead of failing the whole batch
+        try:
+            db._check_open(trans.date, archived_until)
+        except ValueError as error:
+            results[index] = error
+            continue
+
+        valid.append(index)
+
+    ids = db.add_transactions([transactions[index] for index in valid])
+    for index, transaction_id in zip(valid, ids):
+        results[index] = transaction_id if transaction_id is not None else TransactionExists()
+
+    return results
+
+async def _read_request(reader):
+    # (method, target, headers, body) of the next request, or None once the client is done
+    line = await reader.readline()
+    if not line.strip():
+        return None
+
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise HttpError(400, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length', 0) or 0)
+        if length < 0:
+            raise ValueError
+    except ValueError:
+        raise HttpError(400, "Invalid Content-Length")
+    if length > MAX_BODY:
+        raise HttpError(413, "Request body too large")
+    body = await reader.readexactly(length) if length else b''
+
+    return method.upper(), target, headers, body
+
+async def _write_response(writer, status, payload, keep_alive):
+    body = json.dumps(payload, default=_json_default).encode('utf-8')
+    head = (f'HTTP/1.1 {status} {REASONS.get(status, "")}\r\n'
+            'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+    writer.write(head.encode('latin-1') + body)
+    await writer.drain()
+
+async def serve(path, host='127.0.0.1', port=8080, readers=4):
+    server = await LedgerServer(path, host, port, readers).start()
+    print(f"Serving {path} on http://{server.host}:{server.port}/")
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
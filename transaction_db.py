@@ -1,5 +1,107 @@
+import hashlib
+import json
+import os
 import sqlite3
-from decimal import Decimal
+import sys
+from bisect import bisect_right
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from itertools import accumulate, chain, islice
+from urllib.parse import quote
+from reconcile import Reconciliation, match_transactions
+from rules import Rule, RuleMatcher
+
+# Number of rows deduplicated and inserted together by import_transactions
+IMPORT_BATCH_SIZE = 5000
+
+# Connection settings accepted by TransactionDb
+JOURNAL_MODES = ('delete', 'truncate', 'persist', 'memory', 'wal', 'off')
+SYNCHRONOUS_LEVELS = ('off', 'normal', 'full', 'extra')
+
+# Default number of rows per page for iter_transactions and display_transactions
+PAGE_SIZE = 50
+
+# Bumped whenever _migrate learns a new schema step
+SCHEMA_VERSION = 12
+
+# user_version of the per-year archive files written by archive_year
+ARCHIVE_VERSION = 1
+
+# SQLite attaches at most 10 databases to a connection unless it was compiled otherwise
+MAX_ATTACHED_ARCHIVES = 10
+
+def to_cents(amount):
+    # Amounts are stored as integer minor units so SQLite can sum them exactly
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def from_cents(cents):
+    return Decimal(int(cents)).scaleb(-2)
+
+def _convert_date(value):
+    # Dates are written as either YYYY-MM-DD or YYYY-MM-DD HH:MM:SS depending on what the caller passed
+    value = value.decode()
+    if len(value) > 10:
+        return datetime.fromisoformat(value)
+    return date.fromisoformat(value)
+
+# Decimal parameters are bound as cents, and columns declared CENTS are read back as Decimal
+# on connections opened with PARSE_DECLTYPES
+sqlite3.register_adapter(Decimal, to_cents)
+
+# Dates are written as YYYY-MM-DD and datetimes as YYYY-MM-DD HH:MM:SS[.ffffff], whatever form the
+# caller used, so stored t_date text always sorts the way the dates do (this also replaces sqlite3's
+# default date adapters, deprecated since Python 3.12)
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_converter('CENTS', lambda value: from_cents(value))
+sqlite3.register_converter('DATE', _convert_date)
+
+def _normalize_text(value):
+    # Collapse whitespace and case so cosmetic differences don't defeat duplicate detection
+    return ' '.join(str(value if value is not None else '').split()).lower()
+
+def transaction_fingerprint(account, date, amount, vendor, memo, fitid=None):
+    # Hash of the normalized natural key, used by the unique index on transactions.fingerprint
+    fields = [
+        _normalize_text(account),
+        str(date)[:10],
+        str(Decimal(str(amount)).normalize()),
+        _normalize_text(vendor),
+        _normalize_text(memo),
+    ]
+
+    # The bank's own transaction id tells apart otherwise identical rows
+    if fitid:
+        fields.append(str(fitid).strip())
+
+    return hashlib.sha1('\x1f'.join(fields).encode('utf-8')).hexdigest()
+
+def _parse_date(value):
+    # Dates and datetimes pass through, strings are read as YYYY-MM-DD or a full ISO timestamp
+    if isinstance(value, date):
+        return value
+    value = str(value).strip()
+    if len(value) > 10:
+        return datetime.fromisoformat(value)
+    return date.fromisoformat(value)
+
+def _month(value):
+    # 'YYYY-MM' key of the monthly rollup for a date, datetime or 'YYYY-MM[-DD]' string
+    return str(value)[:7]
+
+def _day_after(value):
+    # Dates may carry a time of day, so inclusive end dates compare against the start of the next day
+    return str(date.fromisoformat(str(value)[:10]) + timedelta(days=1))
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
 
 class EntryExistsError(Exception):
     "Raised when a category already exists"
@@ -9,16 +111,13 @@ class TransactionExists(Exception):
     "Raised when a transaction already exists"
     pass
 
-class Transaction:
+# Columns selected for Transaction rows, in field order
+TRANSACTION_COLUMNS = 'id, account, vendor, amount, category, memo, t_date, fitid'
 
-    def __init__(self, id=None, account=None, vendor=None, amount=0, category=None, memo=None, date=None):
-        self.id = id
-        self.vendor = vendor
-        self.account = account
-        self.amount = Decimal(str(amount))
-        self.category = category
-        self.memo = memo
-        self.date = date
+class Transaction(namedtuple('Transaction', 'id account vendor amount category memo date fitid',
+                             defaults=(None, None, None, Decimal(0), None, None, None, None))):
+    # Immutable record without a per-instance __dict__; use _replace() to derive a modified copy
+    __slots__ = ()
 
     def print(self):
         # Print the transaction details
@@ -30,246 +129,1910 @@ class Transaction:
         print(f"Memo: {self.memo}")
         print(f"Date: {self.date}")
 
-class TransactionDb:
+def transaction_row_factory(cursor, row):
+    # Rows selected as TRANSACTION_COLUMNS already hold Decimal amounts and dates thanks to the
+    # registered converters, so they become records without any per-field work
+    return tuple.__new__(Transaction, row)
+
+# Columns TransactionQuery can select and order by, and the transaction_details column behind each
+QUERY_COLUMNS = {
+    'id': 'id',
+    'account': 'account',
+    'vendor': 'vendor',
+    'amount': 'amount',
+    'category': 'category',
+    'memo': 'memo',
+    'date': 't_date',
+    'fitid': 'fitid',
+    'account_id': 'account_id',
+    'category_id': 'category_id',
+}
+
+# Fields edit_transactions can change, and the transactions column behind each
+EDIT_COLUMNS = {
+    'vendor': 'vendor',
+    'amount': 'amount',
+    'category': 'category_id',
+    'memo': 'memo',
+    'date': 't_date',
+}
+
+# Record types for projected queries, one per column list
+_row_types = {}
+
+def _sort_key(value):
+    # Python ordering matching SQLite's for the merged query results: NULLs first, and dates as their
+    # stored text since date and datetime values don't compare with each other
+    return (value is not None, str(value) if isinstance(value, date) else value)
+
+def _row_factory(columns):
+    if columns == Transaction._fields:
+        return transaction_row_factory
+
+    if columns not in _row_types:
+        _row_types[columns] = namedtuple('Row', columns)
+    row_type = _row_types[columns]
+    return lambda cursor, row: tuple.__new__(row_type, row)
+
+class TransactionQuery:
+    # Composable filter over transaction_details; every method returns a new query so a base query
+    # can be refined in several directions, e.g.
+    #   db.query().categories('food', 'dining').dates('2023-01-01', '2023-03-31').order_by('-amount').limit(10)
+    # List filters are bound as a single JSON array, so the SQL text only depends on which filters,
+    # ordering and columns are used and repeated queries reuse one prepared statement.
+
+    def __init__(self, db):
+        self.db = db
+        self._filters = {}
+        self._order = ('date', 'id')
+        self._columns = Transaction._fields
+        self._limit = -1
+        self._offset = 0
+        # (first day, day after the last) of the dates filter, which decides the archived years to read
+        self._span = (None, None)
+        self._archives = True
+
+    def _copy(self, **changes):
+        query = TransactionQuery(self.db)
+        query.__dict__.update(self.__dict__)
+        query._filters = dict(self._filters)
+        query.__dict__.update(changes)
+        return query
+
+    def _filter(self, name, condition, *params):
+        query = self._copy()
+        query._filters[name] = (condition, params)
+        return query
+
+    def ids(self, *ids):
+        return self._filter('ids', 'id IN (SELECT value FROM json_each(?))', json.dumps([int(id) for id in ids]))
+
+    def accounts(self, *names):
+        # Unknown names match nothing rather than raising
+        return self._filter('accounts', 'account_id IN (SELECT value FROM json_each(?))',
+                            json.dumps(self.db._get_ids('accounts', names)))
+
+    def categories(self, *names):
+        return self._filter('categories', 'category_id IN (SELECT value FROM json_each(?))',
+                            json.dumps(self.db._get_ids('categories', names)))
+
+    def vendor(self, vendor):
+        return self._filter('vendor', 'vendor = ?', str(vendor))
+
+    def memo(self, memo):
+        return self._filter('memo', 'memo = ?', str(memo))
+
+    def amount(self, amount):
+        return self._filter('amount', 'amount = ?', to_cents(amount))
+
+    def amounts(self, min_amount=None, max_amount=None):
+        # Inclusive range, either end may be left open
+        query = self
+        if min_amount is not None:
+            query = query._filter('min_amount', 'amount >= ?', to_cents(min_amount))
+        if max_amount is not None:
+            query = query._filter('max_amount', 'amount <= ?', to_cents(max_amount))
+        return query
+
+    def dates(self, start_date=None, end_date=None):
+        # Inclusive range of days, either end may be left open; archived years outside it aren't read
+        query = self
+        if start_date is not None:
+            query = query._filter('start_date', 't_date >= ?', str(start_date)[:10])
+        if end_date is not None:
+            query = query._filter('end_date', 't_date < ?', _day_after(end_date))
+        return query._copy(_span=(str(start_date)[:10] if start_date is not None else None,
+                                  _day_after(end_date) if end_date is not None else None))
+
+    def on(self, day):
+        return self.dates(day, day)
+
+    def unreconciled(self):
+        # Rows without a bank FITID, i.e. entered by hand and not matched to a statement yet
+        return self._filter('unreconciled', 'fitid IS NULL')
+
+    def active(self):
+        # Only the transactions table itself, never the archived years
+        return self._copy(_archives=False)
+
+    def order_by(self, *columns):
+        # Column names from QUERY_COLUMNS, prefixed with '-' for descending order
+        for column in columns:
+            if column.lstrip('-') not in QUERY_COLUMNS:
+                raise ValueError(f"Unknown column {column}")
+        return self._copy(_order=columns)
+
+    def limit(self, limit, offset=0):
+        return self._copy(_limit=int(limit), _offset=int(offset))
+
+    def select(self, *columns):
+        # Only fetch the given columns; rows become named tuples with those fields
+        for column in columns:
+            if column not in QUERY_COLUMNS:
+                raise ValueError(f"Unknown column {column}")
+        return self._copy(_columns=tuple(columns) or Transaction._fields)
+
+    def _groups(self):
+        # Groups of partitions to read, see TransactionDb._partition_groups
+        if not self._archives:
+            return [((), True)]
+        return self.db._partition_groups(*self._span)
+
+    def _statement(self, group, columns=None):
+        columns = columns or self._columns
+        names = tuple(sorted(self._filters))
+        source, partitions = self.db._union_source(*group)
+        shape = (names, columns, self._order, partitions)
+
+        cached = self.db._query_cache.get(shape)
+        if cached is None:
+            sql = 'SELECT ' + ', '.join(QUERY_COLUMNS[column] for column in columns)
+            sql += ' FROM ' + source
+            if names:
+                sql += ' WHERE ' + ' AND '.join(self._filters[name][0] for name in names)
+            if self._order:
+                sql += ' ORDER BY ' + ', '.join(QUERY_COLUMNS[column.lstrip('-')] +
+                                                (' DESC' if column.startswith('-') else '')
+                                                for column in self._order)
+            sql += ' LIMIT ? OFFSET ?'
+
+            cached = self.db._query_cache[shape] = (sql, _row_factory(columns))
+
+        params = [param for name in names for param in self._filters[name][1]]
+        return cached, params + [self._limit, self._offset]
+
+    def _fetch(self, statement, params):
+        sql, row_factory = statement
+
+        cursor = self.db.conn.cursor()
+        cursor.row_factory = row_factory
+        try:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def all(self):
+        groups = self._groups()
+        if len(groups) == 1:
+            return self._fetch(*self._statement(groups[0]))
+
+        # More archived years than SQLite attaches at once: run the query over each group, keeping
+        # enough rows of each to cover the limit and offset, and merge the results here on the ordering
+        # columns, which are fetched along if they aren't selected
+        ordering = [column.lstrip('-') for column in self._order]
+        columns = self._columns + tuple(column for column in dict.fromkeys(ordering)
+                                        if column not in self._columns)
+        query = self.limit(self._limit + self._offset if self._limit >= 0 else -1)
+
+        rows = []
+        for group in groups:
+            rows += query._fetch(*query._statement(group, columns))
+
+        # One stable sort per ordering column, the last one first
+        for column in reversed(self._order):
+            index = columns.index(column.lstrip('-'))
+            rows.sort(key=lambda row: _sort_key(row[index]), reverse=column.startswith('-'))
+
+        rows = rows[self._offset:] if self._limit < 0 else rows[self._offset:self._offset + self._limit]
+        if columns != self._columns:
+            row_factory = _row_factory(self._columns)
+            rows = [row_factory(None, tuple(row[:len(self._columns)])) for row in rows]
+        return rows
+
+    def first(self):
+        rows = self.limit(1, self._offset).all()
+        return rows[0] if rows else None
+
+    def count(self):
+        names = sorted(self._filters)
+        where = (' WHERE ' + ' AND '.join(self._filters[name][0] for name in names)) if names else ''
+        params = [param for name in names for param in self._filters[name][1]]
+
+        count = 0
+        cursor = self.db.conn.cursor()
+        for group in self._groups():
+            cursor.execute('SELECT COUNT(*) FROM ' + self.db._union_source(*group)[0] + where, params)
+            count += cursor.fetchone()[0]
+        cursor.close()
+        return count
+
+    def __iter__(self):
+        return iter(self.all())
 
-    def __init__(self):
+class TransactionDb:
 
-        # Connect to the SQLite database
-        self.conn   = sqlite3.connect('budget_app.db')
+    def __init__(self, path='budget_app.db', journal_mode='wal', synchronous='normal', cache_size=-64000,
+                 mmap_size=256 * 1024 * 1024, cached_statements=256, instrumentation=None, read_only=False):
+
+        if journal_mode.lower() not in JOURNAL_MODES:
+            raise ValueError(f"Unknown journal mode {journal_mode}")
+        if synchronous.lower() not in SYNCHRONOUS_LEVELS:
+            raise ValueError(f"Unknown synchronous level {synchronous}")
+
+        # Connect to the SQLite database, keeping up to cached_statements prepared statements around;
+        # with an Instrumentation the connection reports its statements and commits to it
+        connect = instrumentation.connect if instrumentation else sqlite3.connect
+        if read_only:
+            # Reader connections never write, so the schema and journal mode are left to a writable one
+            self.conn = connect(f'file:{quote(path)}?mode=ro', uri=True, detect_types=sqlite3.PARSE_DECLTYPES,
+                                cached_statements=cached_statements)
+        else:
+            # uri=True leaves plain paths alone but lets archives be attached with URI parameters
+            self.conn = connect(path, uri=True, detect_types=sqlite3.PARSE_DECLTYPES,
+                                cached_statements=cached_statements)
         self.cursor = self.conn.cursor()
+        self.path = path
+
+        # Nesting depth of transaction() blocks, methods only commit on their own outside of one
+        self._transaction_depth = 0
+
+        # SQL text and row factory of every TransactionQuery shape built so far; sqlite3 keeps the
+        # prepared statement for each distinct SQL text in its own cache
+        self._query_cache = {}
+
+        # Account and category lookups, reloaded after our own changes to those tables or when
+        # another connection has committed since they were read (see _lookups)
+        self._lookup_cache = None
+        self._data_version = None
+
+        # account id -> (sorted days, running balance at the end of each day), built from daily_totals
+        # on first use and kept until anything is written (see _balance_index)
+        self._balance_indexes = {}
+        self._balance_stamp = None
+
+        # Archived years attached to the connection, oldest attachment first (see _attach_archives)
+        self._attached = []
+
+        # WAL with synchronous=normal only syncs at checkpoints instead of on every commit;
+        # cache_size follows SQLite's convention of negative values meaning KiB
+        if not read_only:
+            self.cursor.execute(f'PRAGMA journal_mode = {journal_mode.lower()}')
+        self.cursor.execute(f'PRAGMA synchronous = {synchronous.lower()}')
+        self.cursor.execute(f'PRAGMA cache_size = {int(cache_size)}')
+        self.cursor.execute(f'PRAGMA mmap_size = {int(mmap_size)}')
+
+        # Create the schema for a new database, or upgrade one written by an older version;
+        # an up-to-date database is only read here so opening it stays cheap
+        self.cursor.execute('PRAGMA user_version')
+        if self.cursor.fetchone()[0] != SCHEMA_VERSION:
+            if read_only:
+                raise ValueError(f"{path} has to be opened writable once to create or upgrade its schema")
+
+            self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='transactions'")
+            if self.cursor.fetchone():
+                self._migrate()
+            else:
+                self._create_schema()
+
+        # Check if "uncategorized" category exists, and create it if it doesn't
+        self.cursor.execute('SELECT id FROM categories WHERE name=?', ('uncategorized',))
+        if not self.cursor.fetchone() and not read_only:
+            self.cursor.execute('INSERT INTO categories (name) VALUES (?)', ('uncategorized',))
+            self.conn.commit()
 
-        # Create the categories table if it doesn't exist
+        # Only enforce foreign keys once any table rebuilds are done
+        self.cursor.execute('PRAGMA foreign_keys = ON')
+
+        # Time the public methods from here on, schema upgrades above are left out
+        if instrumentation:
+            instrumentation.attach(self)
+
+    def _create_schema(self):
         self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS categories (
+            CREATE TABLE categories (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                balance DECIMAL DEFAULT 0
+                name TEXT NOT NULL UNIQUE COLLATE NOCASE,
+                balance CENTS DEFAULT 0
             )
         ''')
 
-        # Check if "uncategorized" category exists, and create it if it doesn't
-        self.cursor.execute('SELECT * FROM categories WHERE name=?', ('uncategorized',))
-        if not self.cursor.fetchone():
-            self.cursor.execute('INSERT INTO categories (name) VALUES (?)', ('uncategorized',))
+        self.cursor.execute('''
+            CREATE TABLE accounts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE COLLATE NOCASE,
+                balance CENTS DEFAULT 0,
+                ofx_acctid TEXT
+            )
+        ''')
 
-        # Create the accounts table if it doesn't exist
         self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS accounts (
+            CREATE TABLE transactions (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                balance DECIMAL DEFAULT 0
+                account_id INTEGER NOT NULL REFERENCES accounts (id),
+                vendor TEXT,
+                amount CENTS,
+                category_id INTEGER NOT NULL REFERENCES categories (id),
+                memo TEXT,
+                t_date DATE NOT NULL DEFAULT (date('now')),
+                fitid TEXT,
+                fingerprint TEXT
             )
         ''')
 
-        # Create the transactions table if it doesn't exist
+        self.cursor.execute('CREATE UNIQUE INDEX idx_accounts_ofx_acctid ON accounts (ofx_acctid)')
+
+        self._create_rules_table()
+        self._create_schema_objects()
+        self._create_monthly_totals()
+        self._create_search_index()
+        self._create_daily_totals()
+        self._create_archive_tables()
+        self._create_change_counter()
+
+        self.cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        self.conn.commit()
+
+    def _create_rules_table(self):
+        # Auto-categorization rules; a NULL condition matches anything, vendor and memo are
+        # case-insensitive substrings and the amount range is inclusive
         self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS transactions (
+            CREATE TABLE category_rules (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                account TEXT,
+                category_id INTEGER NOT NULL REFERENCES categories (id),
                 vendor TEXT,
-                amount DECIMAL,
-                category TEXT,
                 memo TEXT,
-                t_date DATE NOT NULL DEFAULT (date('now'))
+                min_amount CENTS,
+                max_amount CENTS,
+                account_id INTEGER REFERENCES accounts (id),
+                priority INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+
+    def _create_monthly_totals(self):
+        # Per (account, category, month) totals for the reports, months are 'YYYY-MM'
+        self.cursor.execute('''
+            CREATE TABLE monthly_totals (
+                account_id INTEGER NOT NULL,
+                category_id INTEGER NOT NULL,
+                month TEXT NOT NULL,
+                total CENTS NOT NULL DEFAULT 0,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (account_id, category_id, month)
+            ) WITHOUT ROWID
+        ''')
+        self.cursor.execute('CREATE INDEX idx_monthly_totals_month ON monthly_totals (month)')
+
+        # Every write to transactions adjusts the one or two rollup rows it touches;
+        # rows left without transactions are dropped so the table only holds active months
+        self.cursor.execute('''
+            CREATE TRIGGER trg_transactions_insert_monthly AFTER INSERT ON transactions
+            BEGIN
+                INSERT INTO monthly_totals (account_id, category_id, month, total, count)
+                VALUES (NEW.account_id, NEW.category_id, substr(NEW.t_date, 1, 7), COALESCE(NEW.amount, 0), 1)
+                ON CONFLICT (account_id, category_id, month)
+                DO UPDATE SET total = total + excluded.total, count = count + 1;
+            END
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER trg_transactions_delete_monthly AFTER DELETE ON transactions
+            BEGIN
+                UPDATE monthly_totals SET total = total - COALESCE(OLD.amount, 0), count = count - 1
+                WHERE account_id = OLD.account_id AND category_id = OLD.category_id
+                  AND month = substr(OLD.t_date, 1, 7);
+                DELETE FROM monthly_totals
+                WHERE account_id = OLD.account_id AND category_id = OLD.category_id
+                  AND month = substr(OLD.t_date, 1, 7) AND count = 0;
+            END
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER trg_transactions_update_monthly
+            AFTER UPDATE OF amount, account_id, category_id, t_date ON transactions
+            BEGIN
+                UPDATE monthly_totals SET total = total - COALESCE(OLD.amount, 0), count = count - 1
+                WHERE account_id = OLD.account_id AND category_id = OLD.category_id
+                  AND month = substr(OLD.t_date, 1, 7);
+                DELETE FROM monthly_totals
+                WHERE account_id = OLD.account_id AND category_id = OLD.category_id
+                  AND month = substr(OLD.t_date, 1, 7) AND count = 0;
+                INSERT INTO monthly_totals (account_id, category_id, month, total, count)
+                VALUES (NEW.account_id, NEW.category_id, substr(NEW.t_date, 1, 7), COALESCE(NEW.amount, 0), 1)
+                ON CONFLICT (account_id, category_id, month)
+                DO UPDATE SET total = total + excluded.total, count = count + 1;
+            END
+        ''')
+
+    def _create_daily_totals(self):
+        # Net amount per account and day ('YYYY-MM-DD'), the base of the as-of-date balances
+        self.cursor.execute('''
+            CREATE TABLE daily_totals (
+                account_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                total CENTS NOT NULL DEFAULT 0,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (account_id, day)
+            ) WITHOUT ROWID
+        ''')
+
+        # Keep accounts.balance and the one or two daily rows a write touches current, however far
+        # back the transaction is dated
+        self.cursor.execute('''
+            CREATE TRIGGER trg_transactions_insert_account AFTER INSERT ON transactions
+            BEGIN
+                UPDATE accounts SET balance = COALESCE(balance, 0) + COALESCE(NEW.amount, 0)
+                WHERE id = NEW.account_id;
+                INSERT INTO daily_totals (account_id, day, total, count)
+                VALUES (NEW.account_id, substr(NEW.t_date, 1, 10), COALESCE(NEW.amount, 0), 1)
+                ON CONFLICT (account_id, day) DO UPDATE SET total = total + excluded.total, count = count + 1;
+            END
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER trg_transactions_delete_account AFTER DELETE ON transactions
+            BEGIN
+                UPDATE accounts SET balance = COALESCE(balance, 0) - COALESCE(OLD.amount, 0)
+                WHERE id = OLD.account_id;
+                UPDATE daily_totals SET total = total - COALESCE(OLD.amount, 0), count = count - 1
+                WHERE account_id = OLD.account_id AND day = substr(OLD.t_date, 1, 10);
+                DELETE FROM daily_totals
+                WHERE account_id = OLD.account_id AND day = substr(OLD.t_date, 1, 10) AND count = 0;
+            END
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER trg_transactions_update_account AFTER UPDATE OF amount, account_id, t_date ON transactions
+            BEGIN
+                UPDATE accounts SET balance = COALESCE(balance, 0) - COALESCE(OLD.amount, 0)
+                WHERE id = OLD.account_id;
+                UPDATE accounts SET balance = COALESCE(balance, 0) + COALESCE(NEW.amount, 0)
+                WHERE id = NEW.account_id;
+                UPDATE daily_totals SET total = total - COALESCE(OLD.amount, 0), count = count - 1
+                WHERE account_id = OLD.account_id AND day = substr(OLD.t_date, 1, 10);
+                DELETE FROM daily_totals
+                WHERE account_id = OLD.account_id AND day = substr(OLD.t_date, 1, 10) AND count = 0;
+                INSERT INTO daily_totals (account_id, day, total, count)
+                VALUES (NEW.account_id, substr(NEW.t_date, 1, 10), COALESCE(NEW.amount, 0), 1)
+                ON CONFLICT (account_id, day) DO UPDATE SET total = total + excluded.total, count = count + 1;
+            END
+        ''')
+
+    def _create_search_index(self):
+        # Full-text index over vendor and memo; it reads the text back from transactions so nothing
+        # is stored twice, and the triggers below keep it in step with every write
+        self.cursor.execute('''
+            CREATE VIRTUAL TABLE transactions_fts USING fts5 (
+                vendor, memo,
+                content='transactions', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER trg_transactions_insert_fts AFTER INSERT ON transactions
+            BEGIN
+                INSERT INTO transactions_fts (rowid, vendor, memo) VALUES (NEW.id, NEW.vendor, NEW.memo);
+            END
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER trg_transactions_delete_fts AFTER DELETE ON transactions
+            BEGIN
+                INSERT INTO transactions_fts (transactions_fts, rowid, vendor, memo)
+                VALUES ('delete', OLD.id, OLD.vendor, OLD.memo);
+            END
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER trg_transactions_update_fts AFTER UPDATE OF vendor, memo ON transactions
+            BEGIN
+                INSERT INTO transactions_fts (transactions_fts, rowid, vendor, memo)
+                VALUES ('delete', OLD.id, OLD.vendor, OLD.memo);
+                INSERT INTO transactions_fts (rowid, vendor, memo) VALUES (NEW.id, NEW.vendor, NEW.memo);
+            END
+        ''')
+
+    def _create_archive_tables(self):
+        # Years moved out by archive_year, with the path of each one's file (relative paths are
+        # taken relative to the ledger) and per (account, category) closing totals, so balances
+        # never have to open the archives
+        self.cursor.execute('''
+            CREATE TABLE archives (
+                year INTEGER PRIMARY KEY,
+                path TEXT NOT NULL,
+                rows INTEGER NOT NULL
             )
         ''')
+        self.cursor.execute('''
+            CREATE TABLE archive_totals (
+                year INTEGER NOT NULL REFERENCES archives (year),
+                account_id INTEGER NOT NULL,
+                category_id INTEGER NOT NULL,
+                total CENTS NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (year, account_id, category_id)
+            ) WITHOUT ROWID
+        ''')
+
+    def _create_change_counter(self):
+        # A single row counting every write to transactions, so snapshots of the table (see
+        # analytics.load_columns) can tell whether anything changed since they were taken
+        self.cursor.execute('''
+            CREATE TABLE change_counter (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                changes INTEGER NOT NULL
+            )
+        ''')
+        self.cursor.execute('INSERT INTO change_counter (id, changes) VALUES (1, 0)')
+        for event in ('INSERT', 'DELETE', 'UPDATE'):
+            self.cursor.execute(f'''
+                CREATE TRIGGER trg_transactions_{event.lower()}_changes AFTER {event} ON transactions
+                BEGIN
+                    UPDATE change_counter SET changes = changes + 1 WHERE id = 1;
+                END
+            ''')
+
+    def _create_schema_objects(self):
+        self.cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_fingerprint '
+                            'ON transactions (fingerprint)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_transactions_category_date '
+                            'ON transactions (category_id, t_date)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_transactions_account_date '
+                            'ON transactions (account_id, t_date)')
+        # Keyed (t_date, id) through the rowid, so unfiltered listings walk it in order
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (t_date)')
+
+        # Transactions with their account and category names resolved, in the original column order
+        self.cursor.execute('''
+            CREATE VIEW IF NOT EXISTS transaction_details AS
+            SELECT transactions.id AS id,
+                   accounts.name AS account,
+                   transactions.vendor AS vendor,
+                   transactions.amount AS amount,
+                   categories.name AS category,
+                   transactions.memo AS memo,
+                   transactions.t_date AS t_date,
+                   transactions.fitid AS fitid,
+                   transactions.account_id AS account_id,
+                   transactions.category_id AS category_id
+            FROM transactions
+            JOIN accounts ON accounts.id = transactions.account_id
+            JOIN categories ON categories.id = transactions.category_id
+        ''')
+
+        # Keep the cached category balances in step with every write to transactions
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_transactions_insert_balance AFTER INSERT ON transactions
+            BEGIN
+                UPDATE categories SET balance = COALESCE(balance, 0) + COALESCE(NEW.amount, 0)
+                WHERE id = NEW.category_id;
+            END
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_transactions_delete_balance AFTER DELETE ON transactions
+            BEGIN
+                UPDATE categories SET balance = COALESCE(balance, 0) - COALESCE(OLD.amount, 0)
+                WHERE id = OLD.category_id;
+            END
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_transactions_update_balance
+            AFTER UPDATE OF amount, category_id ON transactions
+            BEGIN
+                UPDATE categories SET balance = COALESCE(balance, 0) - COALESCE(OLD.amount, 0)
+                WHERE id = OLD.category_id;
+                UPDATE categories SET balance = COALESCE(balance, 0) + COALESCE(NEW.amount, 0)
+                WHERE id = NEW.category_id;
+            END
+        ''')
+
+    def _migrate(self):
+        # Bring databases created by older versions up to the current schema
+        self.cursor.execute('PRAGMA user_version')
+        version = self.cursor.fetchone()[0]
+
+        if version < 10:
+            # Created ahead of the other steps since the balance and rollup rebuilds below read them
+            self._create_archive_tables()
+
+        if version < 1:
+            # Fingerprint column with a unique index so duplicate checks are an index probe
+            self.cursor.execute('PRAGMA table_info(transactions)')
+            columns = [row[1] for row in self.cursor.fetchall()]
+            if 'fitid' not in columns:
+                self.cursor.execute('ALTER TABLE transactions ADD COLUMN fitid TEXT')
+            if 'fingerprint' not in columns:
+                self.cursor.execute('ALTER TABLE transactions ADD COLUMN fingerprint TEXT')
+
+            self._backfill_fingerprints()
+
+            self.cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_fingerprint '
+                                'ON transactions (fingerprint)')
+
+        if version < 2:
+            self._migrate_to_foreign_keys()
+
+        if version < 3:
+            self._migrate_to_cents()
 
+        if version < 4:
+            # Balance triggers, starting from balances that match the transactions
+            self._create_schema_objects()
+            self.recalculate_category_balances()
+
+        if version < 5:
+            # OFX ACCTID of each account, so statement files can be routed without asking
+            self.cursor.execute('ALTER TABLE accounts ADD COLUMN ofx_acctid TEXT')
+            self.cursor.execute('CREATE UNIQUE INDEX idx_accounts_ofx_acctid ON accounts (ofx_acctid)')
+
+        if version < 6:
+            self._create_rules_table()
+
+        if version < 7:
+            self._create_monthly_totals()
+            self.rebuild_monthly_totals()
+
+        if version < 8:
+            self._create_search_index()
+            self.cursor.execute("INSERT INTO transactions_fts (transactions_fts) VALUES ('rebuild')")
+
+        if version < 9:
+            self._create_daily_totals()
+            self.rebuild_account_balances()
+
+        if version < 11:
+            self._create_change_counter()
+
+        if version < 12:
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (t_date)')
+
+        self.cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
         self.conn.commit()
 
+    def _backfill_fingerprints(self):
+        self.cursor.execute('SELECT id, account, t_date, amount, vendor, memo, fitid FROM transactions '
+                            'WHERE fingerprint IS NULL ORDER BY id')
+
+        seen = set()
+        updates = []
+        for id, account, date, amount, vendor, memo, fitid in self.cursor.fetchall():
+            fingerprint = transaction_fingerprint(account, date, amount, vendor, memo, fitid)
+
+            # Keep rows that were already duplicated before the index existed, but only
+            # let the first one claim the plain fingerprint
+            if fingerprint in seen:
+                updates.append((f"{fingerprint}:{id}", id))
+            else:
+                seen.add(fingerprint)
+                updates.append((fingerprint, id))
+
+        self.cursor.executemany('UPDATE transactions SET fingerprint=? WHERE id=?', updates)
+
+    def _migrate_to_foreign_keys(self):
+        # Version 2 replaces the free-text account/category columns with integer keys and makes
+        # names unique case-insensitively; SQLite can't alter constraints so the tables are rebuilt
+        for table in ('categories', 'accounts'):
+            self.cursor.execute(f'''
+                CREATE TABLE {table}_new (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL UNIQUE COLLATE NOCASE,
+                    balance DECIMAL DEFAULT 0
+                )
+            ''')
+            self.cursor.execute(f'''
+                INSERT INTO {table}_new (id, name, balance)
+                SELECT MIN(id), LOWER(TRIM(name)), 0 FROM {table}
+                WHERE name IS NOT NULL
+                GROUP BY LOWER(TRIM(name))
+            ''')
+
+        # Names only ever referenced by transactions become real rows
+        self.cursor.execute('''
+            INSERT OR IGNORE INTO categories_new (name)
+            SELECT DISTINCT LOWER(TRIM(COALESCE(category, 'uncategorized'))) FROM transactions
+        ''')
+        self.cursor.execute('''
+            INSERT OR IGNORE INTO accounts_new (name)
+            SELECT DISTINCT LOWER(TRIM(COALESCE(account, 'unknown'))) FROM transactions
+        ''')
+
+        self.cursor.execute('''
+            CREATE TABLE transactions_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                account_id INTEGER NOT NULL REFERENCES accounts (id),
+                vendor TEXT,
+                amount DECIMAL,
+                category_id INTEGER NOT NULL REFERENCES categories (id),
+                memo TEXT,
+                t_date DATE NOT NULL DEFAULT (date('now')),
+                fitid TEXT,
+                fingerprint TEXT
+            )
+        ''')
+        self.cursor.execute('''
+            INSERT INTO transactions_new (id, account_id, vendor, amount, category_id, memo, t_date, fitid, fingerprint)
+            SELECT transactions.id, accounts_new.id, vendor, amount, categories_new.id, memo, t_date, fitid, fingerprint
+            FROM transactions
+            JOIN accounts_new ON accounts_new.name = LOWER(TRIM(COALESCE(transactions.account, 'unknown')))
+            JOIN categories_new ON categories_new.name = LOWER(TRIM(COALESCE(transactions.category, 'uncategorized')))
+        ''')
+
+        for table in ('transactions', 'categories', 'accounts'):
+            self.cursor.execute(f'DROP TABLE {table}')
+            self.cursor.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+
+        self._create_schema_objects()
+
+        self.cursor.execute('''
+            UPDATE categories SET balance =
+                (SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE category_id = categories.id)
+        ''')
+
+    def _migrate_to_cents(self):
+        # Version 3 stores amounts and balances as INTEGER cents in columns declared CENTS
+        self.cursor.execute('DROP VIEW IF EXISTS transaction_details')
+
+        for table in ('categories', 'accounts'):
+            self.cursor.execute(f'''
+                CREATE TABLE {table}_new (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL UNIQUE COLLATE NOCASE,
+                    balance CENTS DEFAULT 0
+                )
+            ''')
+            self.cursor.execute(f'''
+                INSERT INTO {table}_new (id, name, balance)
+                SELECT id, name, CAST(ROUND(COALESCE(balance, 0) * 100) AS INTEGER) FROM {table}
+            ''')
+
+        self.cursor.execute('''
+            CREATE TABLE transactions_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                account_id INTEGER NOT NULL REFERENCES accounts (id),
+                vendor TEXT,
+                amount CENTS,
+                category_id INTEGER NOT NULL REFERENCES categories (id),
+                memo TEXT,
+                t_date DATE NOT NULL DEFAULT (date('now')),
+                fitid TEXT,
+                fingerprint TEXT
+            )
+        ''')
+        self.cursor.execute('''
+            INSERT INTO transactions_new (id, account_id, vendor, amount, category_id, memo, t_date, fitid, fingerprint)
+            SELECT id, account_id, vendor, CAST(ROUND(COALESCE(amount, 0) * 100) AS INTEGER), category_id, memo,
+                   t_date, fitid, fingerprint
+            FROM transactions
+        ''')
+
+        for table in ('transactions', 'categories', 'accounts'):
+            self.cursor.execute(f'DROP TABLE {table}')
+            self.cursor.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+
+        self._create_schema_objects()
+
     def close_database(self):
         # Close the database connection
         self.cursor.close()
         self.conn.close()
 
+    @contextmanager
+    def transaction(self):
+        # Unit of work: every operation inside the block is committed once at the end,
+        # or rolled back together if the block raises
+        self._transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self.conn.rollback()
+                self._lookup_cache = None
+            raise
+
+        self._transaction_depth -= 1
+        if self._transaction_depth == 0:
+            self.conn.commit()
+
+    def _commit(self):
+        if self._transaction_depth == 0:
+            self.conn.commit()
+
+    def _rollback(self):
+        # End the implicit transaction a failed or ignored write opened, unless a transaction() block
+        # owns it and will roll back itself
+        if self._transaction_depth == 0:
+            self.conn.rollback()
+            self._lookup_cache = None
+
+    def _lookups(self):
+        # {'accounts': {name: id}, 'categories': {name: id}, 'ofx': {ofx_acctid: account name},
+        # 'archives': {year: path}}, names in id order and years in order. data_version only changes
+        # when another connection commits, so our own writes to accounts and categories drop the cache
+        # themselves.
+        self.cursor.execute('PRAGMA data_version')
+        data_version = self.cursor.fetchone()[0]
+
+        if self._lookup_cache is None or data_version != self._data_version:
+            self.cursor.execute('SELECT name, id, ofx_acctid FROM accounts ORDER BY id')
+            accounts = self.cursor.fetchall()
+            self.cursor.execute('SELECT name, id FROM categories ORDER BY id')
+            categories = self.cursor.fetchall()
+            self.cursor.execute('SELECT year, path FROM archives ORDER BY year')
+            self._lookup_cache = {
+                'accounts': {name: id for name, id, ofx_acctid in accounts},
+                'categories': dict(categories),
+                'ofx': {ofx_acctid: name for name, id, ofx_acctid in accounts if ofx_acctid is not None},
+                'archives': dict(self.cursor.fetchall()),
+            }
+            self._data_version = data_version
+
+        return self._lookup_cache
+
+    def _archived_until(self):
+        # First day after the archived years as 'YYYY-MM-DD', or None; years are archived oldest first,
+        # so every row dated before it lives in an archive file
+        archives = self._lookups()['archives']
+        return f'{max(archives) + 1:04d}-01-01' if archives else None
+
+    def _check_open(self, day, archived_until):
+        # Archived years are closed, their transactions can't be added to or changed
+        if archived_until is not None and str(day)[:10] < archived_until:
+            raise ValueError(f"{str(day)[:4]} is archived, its transactions can't change")
+
+    def _archive_path(self, path):
+        if os.path.isabs(path):
+            return path
+        return os.path.join(os.path.dirname(os.path.abspath(self.path)), path)
+
+    def _attach_archives(self, years):
+        # Attach the archive files of the given years read-only and immutable, so SQLite neither locks
+        # nor re-reads them, and return their schema names. Attachments are kept for later statements;
+        # the oldest ones no statement at hand needs are detached when the attach limit is reached.
+        if len(years) > MAX_ATTACHED_ARCHIVES:
+            raise ValueError(f"The date range spans more than {MAX_ATTACHED_ARCHIVES} archived years")
+
+        archives = self._lookups()['archives']
+        missing = [year for year in years if year not in self._attached]
+        evict = len(self._attached) + len(missing) - MAX_ATTACHED_ARCHIVES
+
+        # SQLite refuses to detach while a transaction is open
+        if evict > 0 and self.conn.in_transaction:
+            raise ValueError(f"Can't read more than {MAX_ATTACHED_ARCHIVES} archived years inside a "
+                             f"transaction, commit first or narrow the date range")
+
+        try:
+            for stale in [year for year in self._attached if year not in years][:max(evict, 0)]:
+                self.cursor.execute(f'DETACH DATABASE archive_{stale}')
+                self._attached.remove(stale)
+
+            for year in missing:
+                uri = f'file:{quote(self._archive_path(archives[year]))}?mode=ro&immutable=1'
+                self.cursor.execute(f'ATTACH DATABASE ? AS archive_{year}', (uri,))
+                self._attached.append(year)
+        except sqlite3.OperationalError as error:
+            raise ValueError(f"Can't open the archived years {', '.join(map(str, missing))}: {error}")
+
+        return [f'archive_{year}' for year in years]
+
+    def _partitions(self, start=None, end=None):
+        # Archived years a range of days ('YYYY-MM-DD', the end exclusive, either may be None) reaches
+        # into, and whether it reaches the transactions table too
+        archived_until = self._archived_until()
+        if archived_until is None:
+            return [], True
+
+        years = [year for year in self._lookups()['archives']
+                 if (start is None or start < f'{year + 1:04d}-01-01') and (end is None or end > f'{year:04d}-01-01')]
+        return years, end is None or end > archived_until
+
+    def _partition_groups(self, start=None, end=None):
+        # The partitions of a range of days (see _partitions) as (years, active) groups small enough to
+        # be attached at once, the transactions table going with the first
+        years, active = self._partitions(start, end)
+        if len(years) <= MAX_ATTACHED_ARCHIVES:
+            return [(years, active)]
+        return [(years[index:index + MAX_ATTACHED_ARCHIVES], active and index == 0)
+                for index in range(0, len(years), MAX_ATTACHED_ARCHIVES)]
+
+    def _union_source(self, years, active):
+        # FROM clause with transaction_details' columns over the given partitions: the view itself
+        # without archived years, otherwise a UNION ALL of the view (when active) and the archives,
+        # which SQLite filters arm by arm. Also returns the partitions, for the query cache.
+        if not years:
+            return 'transaction_details', ()
+
+        arms = ['SELECT * FROM main.transaction_details'] if active else []
+        arms += [self._archive_details(schema) for schema in self._attach_archives(years)]
+        return f"({' UNION ALL '.join(arms)}) AS transaction_details", (tuple(years), active)
+
+    def _archive_details(self, schema):
+        # transaction_details over an attached archive, names resolved from the ledger's own tables
+        return f'''
+            SELECT t.id AS id, accounts.name AS account, t.vendor AS vendor, t.amount AS amount,
+                   categories.name AS category, t.memo AS memo, t.t_date AS t_date, t.fitid AS fitid,
+                   t.account_id AS account_id, t.category_id AS category_id
+            FROM {schema}.transactions AS t
+            JOIN main.accounts ON accounts.id = t.account_id
+            JOIN main.categories ON categories.id = t.category_id
+        '''
 
-    def add_category(self, name):
-        # Convert the category name to lowercase
-        lowercase_name = name.lower()
 
-        # Check if the category already exists
-        self.cursor.execute('SELECT * FROM categories WHERE LOWER(name)=?', (lowercase_name,))
-        if self.cursor.fetchone():
+    def add_category(self, name):
+        # Insert the lowercase category name, the unique index rejects existing names in any case
+        try:
+            self.cursor.execute('INSERT INTO categories (name) VALUES (?)', (name.lower(),))
+        except sqlite3.IntegrityError:
+            self._rollback()
             raise EntryExistsError
 
-        # Insert the lowercase category name into the database
-        self.cursor.execute('INSERT INTO categories (name) VALUES (?)', (lowercase_name,))
-        self.conn.commit()
+        self._lookup_cache = None
+        self._commit()
 
     def add_account(self, name):
-        # Convert the category name to lowercase
-        lowercase_name = name.lower()
+        # Insert the lowercase account name, the unique index rejects existing names in any case
+        try:
+            self.cursor.execute('INSERT INTO accounts (name) VALUES (?)', (name.lower(),))
+        except sqlite3.IntegrityError:
+            self._rollback()
+            raise EntryExistsError
 
-        # Check if the category already exists
-        self.cursor.execute('SELECT * FROM accounts WHERE LOWER(name)=?', (lowercase_name,))
-        if self.cursor.fetchone():
+        self._lookup_cache = None
+        self._commit()
+
+    def link_account(self, name, ofx_acctid):
+        # Remember which OFX ACCTID statements belong to the account
+        account_id = self._get_account_id(name)
+        try:
+            self.cursor.execute('UPDATE accounts SET ofx_acctid=? WHERE id=?', (ofx_acctid, account_id))
+        except sqlite3.IntegrityError:
+            self._rollback()
             raise EntryExistsError
 
-        # Insert the lowercase category name into the database
-        self.cursor.execute('INSERT INTO accounts (name) VALUES (?)', (lowercase_name,))
-        self.conn.commit()
+        self._lookup_cache = None
+        self._commit()
 
-    def remove_category(self, name):
-        # Check if the category exists
-        self.cursor.execute('SELECT * FROM categories WHERE name=?', (name.lower(),))
-        category = self.cursor.fetchone()
-        if not category:
+    def get_account_for_ofx_id(self, ofx_acctid):
+        # Name of the account linked to an OFX ACCTID, or None
+        return self._lookups()['ofx'].get(ofx_acctid)
+
+    def rename_category(self, name, new_name):
+        # Transactions reference the category by id, so only the category row changes
+        try:
+            self.cursor.execute('UPDATE categories SET name=? WHERE name=?', (new_name.lower(), name))
+        except sqlite3.IntegrityError:
+            self._rollback()
+            raise EntryExistsError
+
+        if self.cursor.rowcount == 0:
+            self._rollback()
             raise EntryExistsError
 
-        # Retrieve the category ID
-        category_id = category[0]
+        self._lookup_cache = None
+        self._commit()
 
-        # Update transactions with the specified category to "uncategorized"
-        self.cursor.execute('UPDATE transactions SET category="uncategorized" WHERE category=?', (name,))
+    def _get_category_id(self, name):
+        # Names are stored lowercase, so lowercasing matches the NOCASE lookups
+        category_id = self._lookups()['categories'].get(str(name).lower())
+        if category_id is None:
+            raise EntryExistsError
+        return category_id
 
-        # Full category rebalance
-        self.recalculate_category_balances()
+    def _get_account_id(self, name):
+        account_id = self._lookups()['accounts'].get(str(name).lower())
+        if account_id is None:
+            raise EntryExistsError
+        return account_id
+
+    def remove_category(self, name):
+        # Check if the category exists and retrieve its ID
+        category_id = self._get_category_id(name)
+
+        # Archived transactions can't move to uncategorized, so their categories stay
+        self.cursor.execute('SELECT 1 FROM archive_totals WHERE category_id=? LIMIT 1', (category_id,))
+        if self.cursor.fetchone():
+            raise ValueError(f"Category {name} has archived transactions")
+
+        # Update transactions with the specified category to "uncategorized", the balance
+        # triggers move their amounts across
+        self.cursor.execute('UPDATE transactions SET category_id=? WHERE category_id=?',
+                            (self._get_category_id('uncategorized'), category_id))
+
+        # Rules can't point at a category that no longer exists
+        self.cursor.execute('DELETE FROM category_rules WHERE category_id=?', (category_id,))
 
         # Remove the category from the database
         self.cursor.execute('DELETE FROM categories WHERE id=?', (category_id,))
-        self.conn.commit()
+        self._lookup_cache = None
+        self._commit()
 
     def remove_account(self, name):
-        # Check if the account exists
-        self.cursor.execute('SELECT * FROM accounts WHERE name=?', (name.lower(),))
-        account = self.cursor.fetchone()
-        if not account:
-            raise EntryExistsError
+        # Check if the account exists and retrieve its ID
+        account_id = self._get_account_id(name)
 
-        self.cursor.execute('DELETE FROM transactions WHERE account = ?', (account,))
-        self.conn.commit()
+        # Archived transactions can't be deleted with it
+        self.cursor.execute('SELECT 1 FROM archive_totals WHERE account_id=? LIMIT 1', (account_id,))
+        if self.cursor.fetchone():
+            raise ValueError(f"Account {name} has archived transactions")
 
-        # Retrieve the category ID
-        category_id = account[0]
+        # The balance triggers take the deleted amounts off their categories
+        self.cursor.execute('DELETE FROM transactions WHERE account_id=?', (account_id,))
+        self.cursor.execute('DELETE FROM category_rules WHERE account_id=?', (account_id,))
 
         # Remove the account from the database
-        self.cursor.execute('DELETE FROM accounts WHERE id=?', (category_id,))
-        self.conn.commit()
-
-        # Full category rebalance
-        self.recalculate_category_balances()
+        self.cursor.execute('DELETE FROM accounts WHERE id=?', (account_id,))
+        self._lookup_cache = None
+        self._commit()
 
     def get_categories(self):
-        # Retrieve categories from the database
-        self.cursor.execute('SELECT * FROM categories')
-        rows = self.cursor.fetchall()
-        categories = [row[1] for row in rows]
-        categories = [category.lower() for category in categories]  # Convert category names to lowercase
-        return categories
+        # Category names in the order they were added, names are stored lowercase
+        return list(self._lookups()['categories'])
 
     def get_accounts(self):
-        # Retrieve categories from the database
-        self.cursor.execute('SELECT * FROM accounts')
-        rows = self.cursor.fetchall()
-        accounts = [row[1].lower() for row in rows]
-        return accounts
+        # Account names in the order they were added, names are stored lowercase
+        return list(self._lookups()['accounts'])
 
     def get_category_balances(self):
-        self.cursor.execute("SELECT categories.id, categories.name, SUM(transactions.amount) "
-                            "FROM categories "
-                            "LEFT JOIN transactions ON categories.name = transactions.category "
-                            "GROUP BY categories.id, categories.name")
+        # Balances are kept current by the transaction triggers
+        self.cursor.execute('SELECT id, name, balance FROM categories ORDER BY id')
         category_balances = self.cursor.fetchall()
 
         resolved_balances = []
 
         for id, name, balance in category_balances:
-            if balance is None:
-                resolved_balance = Decimal(0)
-            else:
-                resolved_balance = Decimal(str(balance))
-            resolved_balances.append([id, name, resolved_balance])
+            resolved_balances.append([id, name, balance if balance is not None else Decimal(0)])
 
         return resolved_balances
 
-    def add_transaction(self, account, vendor, amount, category, memo, date):
+    def get_account_balances(self):
+        # [id, name, balance] for every account, kept current by the transaction triggers
+        self.cursor.execute('SELECT id, name, balance FROM accounts ORDER BY id')
+        return [[id, name, balance if balance is not None else Decimal(0)]
+                for id, name, balance in self.cursor.fetchall()]
+
+    def _balance_index(self, account_id):
+        # Any write by this connection bumps total_changes and any commit by another one bumps
+        # data_version; either means the cached running balances may be stale
+        self.cursor.execute('PRAGMA data_version')
+        stamp = (self.cursor.fetchone()[0], self.conn.total_changes)
+        if stamp != self._balance_stamp:
+            self._balance_indexes = {}
+            self._balance_stamp = stamp
+
+        index = self._balance_indexes.get(account_id)
+        if index is None:
+            self.cursor.execute('SELECT day, CAST(total AS INTEGER) FROM daily_totals WHERE account_id=? ORDER BY day',
+                                (account_id,))
+            rows = self.cursor.fetchall()
+            index = self._balance_indexes[account_id] = ([row[0] for row in rows],
+                                                         list(accumulate(row[1] for row in rows)))
+        return index
+
+    def get_account_balance(self, account, as_of=None):
+        # Balance of the account at the end of the given day (inclusive), or its current balance
+        account_id = self._get_account_id(account)
+        if as_of is None:
+            self.cursor.execute('SELECT balance FROM accounts WHERE id=?', (account_id,))
+            balance = self.cursor.fetchone()[0]
+            return balance if balance is not None else Decimal(0)
+
+        return self.get_balance_history(account, [as_of])[0]
+
+    def get_balance_history(self, account, days):
+        # Balance at the end of each of the given days; each point is a binary search over the
+        # account's running daily balances, so long charts cost O(log N) per point
+        days_with_activity, balances = self._balance_index(self._get_account_id(account))
+
+        history = []
+        for day in days:
+            position = bisect_right(days_with_activity, str(day)[:10])
+            history.append(from_cents(balances[position - 1] if position else 0))
+        return history
+
+    def rebuild_account_balances(self):
+        # Recompute accounts.balance from the transactions and the archived years' closing totals, and
+        # daily_totals from the transactions; the days of archived years were written by archive_year
+        # and are left alone
+        archived_until = self._archived_until() or ''
+        with self.transaction():
+            self.cursor.execute('''
+                UPDATE accounts SET balance =
+                    (SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE account_id = accounts.id) +
+                    (SELECT COALESCE(SUM(total), 0) FROM archive_totals WHERE account_id = accounts.id)
+            ''')
+            self.cursor.execute('DELETE FROM daily_totals WHERE day >= ?', (archived_until,))
+            self.cursor.execute('''
+                INSERT INTO daily_totals (account_id, day, total, count)
+                SELECT account_id, substr(t_date, 1, 10), SUM(COALESCE(amount, 0)), COUNT(*)
+                FROM transactions
+                GROUP BY account_id, substr(t_date, 1, 10)
+            ''')
+
+    def add_rule(self, category, vendor=None, memo=None, min_amount=None, max_amount=None, account=None,
+                 priority=0):
+        # Every condition given must hold for the rule to apply; among matching rules the highest
+        # priority wins, then the oldest
+        if not any(value is not None for value in (vendor, memo, min_amount, max_amount, account)):
+            raise ValueError("A rule needs at least one condition")
+
+        category_id = self._get_category_id(category)
+        account_id = self._get_account_id(account) if account is not None else None
+
+        self.cursor.execute('''
+            INSERT INTO category_rules (category_id, vendor, memo, min_amount, max_amount, account_id, priority)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (category_id, vendor or None, memo or None,
+              to_cents(min_amount) if min_amount is not None else None,
+              to_cents(max_amount) if max_amount is not None else None,
+              account_id, int(priority)))
+        self._commit()
+
+        return self.cursor.lastrowid
+
+    def remove_rule(self, rule_id):
+        self.cursor.execute('DELETE FROM category_rules WHERE id=?', (rule_id,))
+        if self.cursor.rowcount == 0:
+            self._rollback()
+            raise IndexError
+        self._commit()
+
+    def get_rules(self):
+        # Rules with their category and account names resolved, in the order they are tried
+        self.cursor.execute('''
+            SELECT category_rules.id, categories.name, vendor, memo, min_amount, max_amount, accounts.name, priority
+            FROM category_rules
+            JOIN categories ON categories.id = category_rules.category_id
+            LEFT JOIN accounts ON accounts.id = category_rules.account_id
+            ORDER BY priority DESC, category_rules.id
+        ''')
+        return [list(row) for row in self.cursor.fetchall()]
+
+    def get_rule_matcher(self):
+        # Compile every rule into one matcher; amounts stay integer cents so matching never builds a Decimal
+        self.cursor.execute('SELECT id, category_id, vendor, memo, CAST(min_amount AS INTEGER), '
+                            'CAST(max_amount AS INTEGER), account_id, priority FROM category_rules')
+        return RuleMatcher([Rule(*row) for row in self.cursor.fetchall()])
+
+    def _insert_transaction(self, account_id, account_name, vendor, amount, category_id, memo, date, fitid):
+        # Insert one row, letting the fingerprint index reject duplicates; returns its id, or None for a duplicate
+        date = _parse_date(date)
+        self._check_open(date, self._archived_until())
+        fingerprint = transaction_fingerprint(account_name, date, amount, vendor, memo, fitid)
+
+        self.cursor.execute('''
+            INSERT INTO transactions (account_id, vendor, amount, category_id, memo, t_date, fitid, fingerprint)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (fingerprint) DO NOTHING
+        ''', (account_id, str(vendor), to_cents(amount), category_id, str(memo), date, fitid, fingerprint))
+
+        return self.cursor.lastrowid if self.cursor.rowcount else None
+
+    def add_transaction(self, account, vendor, amount, category, memo, date, fitid=None):
 
         # Check if account exists
-        self.cursor.execute('SELECT * FROM accounts WHERE name=?', (account.lower(),))
-        account = self.cursor.fetchone()
-        if not account:
+        account_name = account.lower()
+        account_id = self._lookups()['accounts'].get(account_name)
+        if account_id is None:
             print(f"Account {account} does not exist!")
             raise EntryExistsError
 
-        account_name = account[1]
         print(f"{account_name}")
 
-        # Pull existing transactions and see if any are a match
-        db_trans = self.filter_transactions(vendor=vendor, amount=amount, category=category, memo=memo, date=date)
+        category_id = self._get_category_id(category)
 
-        if db_trans:
+        transaction_id = self._insert_transaction(account_id, account_name, vendor, amount, category_id, memo,
+                                                  date, fitid)
+
+        if transaction_id is None:
             print("-------------------------------------------")
             print(" Transaction already exists, skipping . . .")
             print("-------------------------------------------")
+            # The ignored INSERT still opened a write transaction, don't leave it holding the lock
+            self._rollback()
             raise TransactionExists
 
-        # Insert the transaction into the database
-        self.cursor.execute('''
-            INSERT INTO transactions (account, vendor, amount, category, memo, t_date)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (str(account_name).lower(), str(vendor), str(amount), str(category).lower(), str(memo), date))
-
-        self.conn.commit()
-
-        self.update_category_balance(category, amount)
-
-    def update_category_balance(self, category, amount):
-        print(f"Attempting to update balance for category: {category} by amount: {amount}")
-
-        # Retrieve the current balance for the category from the categories table
-        self.cursor.execute('SELECT balance FROM categories WHERE name=?', (str(category).lower(),))
-        current_balance = self.cursor.fetchone()[0]
-
-        # If current balance doesn't exist, set to 0
-        if current_balance == None:
-            current_balance = Decimal(0)
-        else:
-            current_balance = Decimal(str(current_balance))
+        self._commit()
+
+        return transaction_id
+
+    def add_transactions(self, transactions):
+        # Insert Transaction records (id is ignored) in one unit of work, quietly; returns the new id
+        # of each record, or None where it was a duplicate. An unknown account or category raises
+        # EntryExistsError and nothing is inserted.
+        ids = []
+        with self.transaction():
+            for trans in transactions:
+                ids.append(self._insert_transaction(self._get_account_id(trans.account), str(trans.account).lower(),
+                                                    trans.vendor, trans.amount,
+                                                    self._get_category_id(trans.category or 'uncategorized'),
+                                                    trans.memo, trans.date, trans.fitid))
+        return ids
+
+    def import_transactions(self, account, transactions, apply_rules=True):
+
+        # Resolve the account and the category ids once for the whole batch
+        lookups = self._lookups()
+        account_name = account.lower()
+        account_id = lookups['accounts'].get(account_name)
+        if account_id is None:
+            print(f"Account {account} does not exist!")
+            raise EntryExistsError
 
-        # Calculate the updated balance by adding or subtracting the transaction amount
-        updated_balance = current_balance + amount
+        category_ids = lookups['categories']
+        uncategorized_id = category_ids.get('uncategorized')
+
+        # Uncategorized rows are run through the rules as they are inserted
+        matcher = self.get_rule_matcher() if apply_rules else None
+
+        # Statements overlapping an archived year only add their rows from the open years
+        archived_until = self._archived_until()
+
+        inserted = 0
+        skipped = 0
+
+        # Consume the transactions in batches so a streaming parser never has to be fully materialized,
+        # while still inserting everything in one transaction
+        with self.transaction():
+            for batch in _batched(transactions, IMPORT_BATCH_SIZE):
+                rows = []
+                for trans in batch:
+                    if archived_until is not None and str(trans.date)[:10] < archived_until:
+                        skipped += 1
+                        continue
+
+                    category_id = category_ids.get(str(trans.category).lower())
+                    if category_id is None:
+                        raise EntryExistsError
+
+                    cents = to_cents(trans.amount)
+                    if matcher and category_id == uncategorized_id:
+                        category_id = matcher.match(trans.vendor, trans.memo, cents, account_id) or category_id
+
+                    fitid = trans.fitid
+                    rows.append((account_id, str(trans.vendor), cents, category_id,
+                                 str(trans.memo), _parse_date(trans.date), fitid,
+                                 transaction_fingerprint(account_name, trans.date, trans.amount, trans.vendor,
+                                                         trans.memo, fitid)))
+
+                if not rows:
+                    continue
+
+                # Probe the fingerprint index for the whole batch in one query
+                fingerprints = [row[7] for row in rows]
+                self.cursor.execute('SELECT fingerprint FROM transactions WHERE fingerprint IN (%s)'
+                                    % ','.join('?' * len(fingerprints)), fingerprints)
+                seen = set(row[0] for row in self.cursor.fetchall())
+
+                new_rows = []
+                for row in rows:
+                    if row[7] in seen:
+                        skipped += 1
+                        continue
+                    seen.add(row[7])
+                    new_rows.append(row)
+
+                self.cursor.executemany('''
+                    INSERT INTO transactions (account_id, vendor, amount, category_id, memo, t_date, fitid, fingerprint)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (fingerprint) DO NOTHING
+                ''', new_rows)
+                inserted += len(new_rows)
+
+        return inserted, skipped
+
+    def verify_category_balances(self):
+        # Compare every cached balance against the transactions plus the archived years' closing totals
+        # in a single GROUP BY pass, returning [id, name, cached balance, actual balance] for each
+        # category that is off
+        self.cursor.execute('''
+            SELECT categories.id, categories.name, categories.balance, COALESCE(totals.total, 0)
+            FROM categories
+            LEFT JOIN (
+                SELECT category_id, SUM(amount) AS total
+                FROM (SELECT category_id, amount FROM transactions
+                      UNION ALL SELECT category_id, total FROM archive_totals)
+                GROUP BY category_id
+            ) AS totals
+                ON totals.category_id = categories.id
+            WHERE categories.balance IS NOT COALESCE(totals.total, 0)
+        ''')
 
-        # Update the category's balance in the categories table
-        self.cursor.execute('UPDATE categories SET balance=? WHERE name=?', (str(updated_balance), category))
-        self.conn.commit()
+        return [[id, name, balance, from_cents(total)] for id, name, balance, total in self.cursor.fetchall()]
 
     def recalculate_category_balances(self):
-        categories = self.get_categories()
-
-        for category in categories:
-          # Calculate the balance for the category from transactions
-          self.cursor.execute('SELECT SUM(amount) FROM transactions WHERE category=?', (category,))
-          result = self.cursor.fetchone()
-          balance = Decimal(result[0] or 0)
-
-          # Update the category's balance in the categories table
-          self.cursor.execute('UPDATE categories SET balance=? WHERE name=?', (str(balance), category))
+        # Only the categories that drifted from their transactions are rewritten
+        mismatches = self.verify_category_balances()
+
+        self.cursor.executemany('UPDATE categories SET balance=? WHERE id=?',
+                                [(actual, id) for id, name, cached, actual in mismatches])
+        self._commit()
+
+        return mismatches
+
+    def recategorize(self, only_uncategorized=False):
+        # Re-run the rules over the stored transactions and move only the rows whose category changes;
+        # rows no rule matches keep their category. Returns the number of rows moved.
+        matcher = self.get_rule_matcher()
+        if not matcher:
+            return 0
+
+        query = 'SELECT id, vendor, memo, CAST(amount AS INTEGER), account_id, category_id FROM transactions'
+        params = ()
+        if only_uncategorized:
+            query += ' WHERE category_id = ?'
+            params = (self._get_category_id('uncategorized'),)
+
+        cursor = self.conn.cursor()
+        cursor.execute(query, params)
+
+        changes = []
+        for id, vendor, memo, amount, account_id, category_id in cursor:
+            new_category_id = matcher.match(vendor, memo, amount, account_id)
+            if new_category_id is not None and new_category_id != category_id:
+                changes.append((new_category_id, id))
+        cursor.close()
+
+        # The balance trigger moves each changed amount between the two categories
+        with self.transaction():
+            self.cursor.executemany('UPDATE transactions SET category_id=? WHERE id=?', changes)
+
+        return len(changes)
+
+    def _monthly_conditions(self, start, end, account, category):
+        # WHERE clause and parameters restricting monthly_totals to a month range, account and category
+        conditions = []
+        params = []
 
-        self.conn.commit()
+        if start is not None:
+            conditions.append('monthly_totals.month >= ?')
+            params.append(_month(start))
+        if end is not None:
+            conditions.append('monthly_totals.month <= ?')
+            params.append(_month(end))
+        if account is not None:
+            conditions.append('monthly_totals.account_id = ?')
+            params.append(self._get_account_id(account))
+        if category is not None:
+            conditions.append('monthly_totals.category_id = ?')
+            params.append(self._get_category_id(category))
+
+        return (' WHERE ' + ' AND '.join(conditions)) if conditions else '', params
+
+    def get_monthly_totals(self, start=None, end=None, account=None, category=None):
+        # [month, account, category, total, count] for every month with activity between start and end
+        # (inclusive, any date in the month will do), read from the rollup instead of the transactions
+        where, params = self._monthly_conditions(start, end, account, category)
+        self.cursor.execute(f'''
+            SELECT monthly_totals.month, accounts.name, categories.name, monthly_totals.total, monthly_totals.count
+            FROM monthly_totals
+            JOIN accounts ON accounts.id = monthly_totals.account_id
+            JOIN categories ON categories.id = monthly_totals.category_id
+            {where}
+            ORDER BY monthly_totals.month, accounts.name, categories.name
+        ''', params)
+        return [list(row) for row in self.cursor.fetchall()]
+
+    def get_period_totals(self, start=None, end=None, group_by='category', account=None, category=None):
+        # [key, total, count] summed over the months between start and end, grouped by
+        # 'category', 'account' or 'month'
+        keys = {
+            'category': ('categories.name', 'JOIN categories ON categories.id = monthly_totals.category_id'),
+            'account': ('accounts.name', 'JOIN accounts ON accounts.id = monthly_totals.account_id'),
+            'month': ('monthly_totals.month', ''),
+        }
+        if group_by not in keys:
+            raise ValueError(f"Unknown grouping {group_by}")
+        key, join = keys[group_by]
+
+        where, params = self._monthly_conditions(start, end, account, category)
+        self.cursor.execute(f'''
+            SELECT {key}, SUM(monthly_totals.total), SUM(monthly_totals.count)
+            FROM monthly_totals {join}
+            {where}
+            GROUP BY {key} ORDER BY {key}
+        ''', params)
+        return [[name, from_cents(total), count] for name, total, count in self.cursor.fetchall()]
+
+    def rebuild_monthly_totals(self):
+        # Recompute the rollup from the transactions; the months of archived years were written by
+        # archive_year and are left alone
+        archived_until = self._archived_until() or ''
+        with self.transaction():
+            self.cursor.execute('DELETE FROM monthly_totals WHERE month >= ?', (archived_until[:7],))
+            self.cursor.execute('''
+                INSERT INTO monthly_totals (account_id, category_id, month, total, count)
+                SELECT account_id, category_id, substr(t_date, 1, 7), SUM(COALESCE(amount, 0)), COUNT(*)
+                FROM transactions
+                GROUP BY account_id, category_id, substr(t_date, 1, 7)
+            ''')
+
+    def verify_monthly_totals(self):
+        # Compare the rollup against the transactions, returning [account id, category id, month,
+        # cached total, actual total] for every key that is missing, stale or left over; months of
+        # archived years aren't checked
+        archived_until = self._archived_until() or ''
+        self.cursor.execute('''
+            WITH actual AS (
+                SELECT account_id, category_id, substr(t_date, 1, 7) AS month,
+                       SUM(COALESCE(amount, 0)) AS total, COUNT(*) AS count
+                FROM transactions
+                GROUP BY account_id, category_id, substr(t_date, 1, 7)
+            )
+            SELECT actual.account_id, actual.category_id, actual.month, CAST(monthly_totals.total AS INTEGER),
+                   actual.total
+            FROM actual
+            LEFT JOIN monthly_totals USING (account_id, category_id, month)
+            WHERE monthly_totals.total IS NOT actual.total OR monthly_totals.count IS NOT actual.count
+            UNION ALL
+            SELECT monthly_totals.account_id, monthly_totals.category_id, monthly_totals.month,
+                   CAST(monthly_totals.total AS INTEGER), NULL
+            FROM monthly_totals
+            LEFT JOIN actual USING (account_id, category_id, month)
+            WHERE actual.month IS NULL AND monthly_totals.month >= ?
+        ''', (archived_until[:7],))
+        return [[account_id, category_id, month,
+                 from_cents(cached) if cached is not None else None, from_cents(total or 0)]
+                for account_id, category_id, month, cached, total in self.cursor.fetchall()]
+
+    def get_archives(self):
+        # [year, path, rows] for every archived year, oldest first
+        self.cursor.execute('SELECT year, path, rows FROM archives ORDER BY year')
+        return [list(row) for row in self.cursor.fetchall()]
+
+    def archive_year(self, year, path=None):
+        # Move a closed year's transactions into a SQLite file of their own (by default next to the
+        # ledger, named after it and the year) and return how many were moved. Years are archived
+        # oldest first. Balances and the monthly and daily rollups keep the year's closing totals, so
+        # they read the same afterwards; listings, queries and searches only open the file when their
+        # date range reaches into the year. Archived years can't be written to afterwards.
+        year = int(year)
+        if year >= date.today().year:
+            raise ValueError(f"{year} isn't over yet")
+        if year in self._lookups()['archives']:
+            raise ValueError(f"{year} is already archived")
+        if self._transaction_depth:
+            raise ValueError("Years can't be archived inside a transaction")
+
+        start = f'{year:04d}-01-01'
+        end = f'{year + 1:04d}-01-01'
+
+        self.cursor.execute('SELECT MIN(t_date), COUNT(*) FROM transactions WHERE t_date < ?', (end,))
+        earliest, rows = self.cursor.fetchone()
+        if not rows:
+            raise ValueError(f"No transactions in {year}")
+        if earliest < start:
+            raise ValueError(f"Archive {earliest[:4]} first, years are archived oldest first")
+
+        if path is None:
+            if self.path == ':memory:':
+                raise ValueError("In-memory ledgers need an archive path")
+            path = f'{os.path.splitext(os.path.basename(self.path))[0]}-{year}.db'
+        target = self._archive_path(path)
+        if os.path.exists(target):
+            raise ValueError(f"{target} already exists")
+
+        # Write the file under a temporary name through this connection, so rows are copied inside SQLite
+        building = target + '.tmp'
+        if os.path.exists(building):
+            os.remove(building)
+        self.cursor.execute('ATTACH DATABASE ? AS archive_build', (building,))
+        try:
+            with self.transaction():
+                self.cursor.execute('''
+                    CREATE TABLE archive_build.transactions (
+                        id INTEGER PRIMARY KEY,
+                        account_id INTEGER NOT NULL,
+                        vendor TEXT,
+                        amount CENTS,
+                        category_id INTEGER NOT NULL,
+                        memo TEXT,
+                        t_date DATE NOT NULL,
+                        fitid TEXT,
+                        fingerprint TEXT
+                    )
+                ''')
+                self.cursor.execute('''
+                    INSERT INTO archive_build.transactions
+                    SELECT id, account_id, vendor, amount, category_id, memo, t_date, fitid, fingerprint
+                    FROM main.transactions WHERE t_date >= ? AND t_date < ?
+                    ORDER BY id
+                ''', (start, end))
+                self.cursor.execute('CREATE INDEX archive_build.idx_transactions_category_date '
+                                    'ON transactions (category_id, t_date)')
+                self.cursor.execute('CREATE INDEX archive_build.idx_transactions_account_date '
+                                    'ON transactions (account_id, t_date)')
+                self.cursor.execute('CREATE INDEX archive_build.idx_transactions_date ON transactions (t_date)')
+
+                # The same full-text index the ledger has, built once since the file never changes
+                self.cursor.execute('''
+                    CREATE VIRTUAL TABLE archive_build.transactions_fts USING fts5 (
+                        vendor, memo,
+                        content='transactions', content_rowid='id',
+                        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+                    )
+                ''')
+                self.cursor.execute("INSERT INTO archive_build.transactions_fts (transactions_fts) VALUES ('rebuild')")
+
+                # Closing totals, so the file describes its year on its own
+                self.cursor.execute('''
+                    CREATE TABLE archive_build.closing_totals (
+                        account_id INTEGER NOT NULL,
+                        category_id INTEGER NOT NULL,
+                        account TEXT NOT NULL,
+                        category TEXT NOT NULL,
+                        total CENTS NOT NULL,
+                        count INTEGER NOT NULL,
+                        PRIMARY KEY (account_id, category_id)
+                    )
+                ''')
+                self.cursor.execute('''
+                    INSERT INTO archive_build.closing_totals
+                    SELECT t.account_id, t.category_id, accounts.name, categories.name,
+                           SUM(COALESCE(t.amount, 0)), COUNT(*)
+                    FROM archive_build.transactions AS t
+                    JOIN main.accounts ON accounts.id = t.account_id
+                    JOIN main.categories ON categories.id = t.category_id
+                    GROUP BY t.account_id, t.category_id
+                ''')
+                self.cursor.execute(f'PRAGMA archive_build.user_version = {ARCHIVE_VERSION}')
+        finally:
+            self.cursor.execute('DETACH DATABASE archive_build')
+        os.replace(building, target)
+
+        # The triggers take the deleted rows off every balance and rollup, the closing totals and the
+        # year's monthly and daily totals put them back
+        try:
+            with self.transaction():
+                self.cursor.execute('''
+                    SELECT account_id, category_id, SUM(COALESCE(amount, 0)), COUNT(*) FROM transactions
+                    WHERE t_date >= ? AND t_date < ? GROUP BY account_id, category_id
+                ''', (start, end))
+                closing = self.cursor.fetchall()
+                self.cursor.execute('''
+                    SELECT account_id, category_id, substr(t_date, 1, 7), SUM(COALESCE(amount, 0)), COUNT(*)
+                    FROM transactions
+                    WHERE t_date >= ? AND t_date < ? GROUP BY account_id, category_id, substr(t_date, 1, 7)
+                ''', (start, end))
+                monthly = self.cursor.fetchall()
+                self.cursor.execute('''
+                    SELECT account_id, substr(t_date, 1, 10), SUM(COALESCE(amount, 0)), COUNT(*) FROM transactions
+                    WHERE t_date >= ? AND t_date < ? GROUP BY account_id, substr(t_date, 1, 10)
+                ''', (start, end))
+                daily = self.cursor.fetchall()
+
+                self.cursor.execute('DELETE FROM transactions WHERE t_date >= ? AND t_date < ?', (start, end))
+                moved = self.cursor.rowcount
+
+                self.cursor.executemany('UPDATE categories SET balance = COALESCE(balance, 0) + ? WHERE id = ?',
+                                        [(total, category_id) for account_id, category_id, total, count in closing])
+                self.cursor.executemany('UPDATE accounts SET balance = COALESCE(balance, 0) + ? WHERE id = ?',
+                                        [(total, account_id) for account_id, category_id, total, count in closing])
+                self.cursor.executemany('INSERT INTO monthly_totals (account_id, category_id, month, total, count) '
+                                        'VALUES (?, ?, ?, ?, ?)', monthly)
+                self.cursor.executemany('INSERT INTO daily_totals (account_id, day, total, count) VALUES (?, ?, ?, ?)',
+                                        daily)
+
+                self.cursor.execute('INSERT INTO archives (year, path, rows) VALUES (?, ?, ?)', (year, path, moved))
+                self.cursor.executemany('INSERT INTO archive_totals (year, account_id, category_id, total, count) '
+                                        'VALUES (?, ?, ?, ?, ?)', [(year,) + tuple(row) for row in closing])
+        except BaseException:
+            os.remove(target)
+            raise
+
+        self._lookup_cache = None
+        return moved
 
     def edit_transaction(self, transaction_id, vendor=None, amount=None, category=None, memo=None, date=None):
+        # Fields left as None or blank keep their value; returns the edited transaction
+        changes = {field: value for field, value in (('vendor', vendor), ('amount', amount), ('category', category),
+                                                     ('memo', memo), ('date', date))
+                   if value is not None and value != ''}
+        return self.edit_transactions([(transaction_id, changes)])[0]
+
+    def edit_transactions(self, edits):
+        # Apply (id, {field: value}) edits, fields from EDIT_COLUMNS, in one unit of work and return the
+        # edited transactions in id order. Rows changing the same set of fields share one executemany;
+        # the triggers move the amounts between category and account balances and rollups. Raises
+        # IndexError for an unknown id, EntryExistsError for an unknown category and TransactionExists
+        # if an edit would turn a row into a duplicate of another; nothing is written in those cases.
+        merged = {}
+        for transaction_id, changes in edits:
+            for field in changes:
+                if field not in EDIT_COLUMNS:
+                    raise ValueError(f"Unknown field {field}")
+            merged.setdefault(int(transaction_id), {}).update(changes)
+
+        if not merged:
+            return []
+
+        # Archived transactions can't be edited, their ids are unknown here
+        current = {trans.id: trans for trans in self.query().active().ids(*merged).all()}
+        if len(current) != len(merged):
+            raise IndexError
 
-        old_trans = self.get_transaction(transaction_id)
+        archived_until = self._archived_until()
+
+        shapes = {}
+        for transaction_id, changes in merged.items():
+            changes = dict(changes)
+            if 'amount' in changes:
+                changes['amount'] = Decimal(str(changes['amount']))
+            if 'date' in changes:
+                changes['date'] = _parse_date(changes['date'])
+                self._check_open(changes['date'], archived_until)
+            if 'category' in changes:
+                changes['category'] = str(changes['category']).lower()
+
+            # The fingerprint follows the edited values so duplicate detection keeps working
+            edited = current[transaction_id]._replace(**changes)
+            fingerprint = transaction_fingerprint(edited.account, edited.date, edited.amount, edited.vendor,
+                                                  edited.memo, edited.fitid)
+
+            shape = tuple(sorted(changes))
+            values = [self._get_category_id(changes[field]) if field == 'category' else
+                      to_cents(changes[field]) if field == 'amount' else
+                      changes[field] for field in shape]
+            shapes.setdefault(shape, []).append(values + [fingerprint, transaction_id])
+
+        try:
+            with self.transaction():
+                for shape, rows in shapes.items():
+                    assignments = ''.join(f'{EDIT_COLUMNS[field]} = ?, ' for field in shape)
+                    self.cursor.executemany(f'UPDATE transactions SET {assignments}fingerprint = ? WHERE id = ?', rows)
+        except sqlite3.IntegrityError:
+            raise TransactionExists
 
-        # Update the vendor field if needed
-        if vendor:
-            self.cursor.execute('UPDATE transactions SET vendor=? WHERE id=?', (vendor, transaction_id))
+        return self.query().active().ids(*merged).order_by('id').all()
 
-        # Update the amount field if needed
-        if amount:
-            self.cursor.execute('UPDATE transactions SET amount=? WHERE id=?', (amount, transaction_id))
-            self.update_category_balance(old_trans.category, amount-old_trans.amount)
+    def edit_matching(self, query, changes):
+        # Apply the same changes to every transaction a TransactionQuery matches outside the archived
+        # years, which can't change
+        return self.edit_transactions([(row.id, changes) for row in query.active().select('id').all()])
 
-        # Update the memo field if needed
-        if memo:
-            self.cursor.execute('UPDATE transactions SET memo=? WHERE id=?', (memo, transaction_id))
+    def reconcile(self, account, transactions, date_tolerance=3, min_similarity=0.3):
+        # Match a statement against the account's unreconciled rows dated within its period, pairing
+        # records of the same amount at most date_tolerance days apart with similar vendors (see
+        # reconcile.match_transactions). Nothing is written; review the returned Reconciliation and
+        # pass it to apply_reconciliation.
+        account_name = account.lower()
+        if account_name not in self._lookups()['accounts']:
+            print(f"Account {account} does not exist!")
+            raise EntryExistsError
 
-        # Update the date field if needed
-        if date:
-            self.cursor.execute('UPDATE transactions SET date=? WHERE id=?', (date, transaction_id))
+        statement = [trans._replace(account=account_name, date=_parse_date(trans.date),
+                                    amount=Decimal(str(trans.amount)))
+                     for trans in transactions]
+        if not statement:
+            return Reconciliation(account_name, [], [], [], [])
+
+        # Records already in the ledger exactly would be skipped by an import, keep them out of matching
+        fingerprints = [transaction_fingerprint(account_name, trans.date, trans.amount, trans.vendor, trans.memo,
+                                                trans.fitid) for trans in statement]
+        seen = set()
+        for batch in _batched(fingerprints, IMPORT_BATCH_SIZE):
+            self.cursor.execute('SELECT fingerprint FROM transactions WHERE fingerprint IN (%s)'
+                                % ','.join('?' * len(batch)), batch)
+            seen.update(row[0] for row in self.cursor.fetchall())
+
+        # Rows of archived years count as already imported too, their years are closed
+        archived_until = self._archived_until() or ''
+        duplicates = []
+        for trans, fingerprint in zip(statement, fingerprints):
+            if fingerprint in seen or str(trans.date)[:10] < archived_until:
+                duplicates.append(trans)
+        statement = [trans for trans, fingerprint in zip(statement, fingerprints)
+                     if fingerprint not in seen and str(trans.date)[:10] >= archived_until]
+
+        existing = []
+        if statement:
+            start = min(trans.date for trans in statement) - timedelta(days=date_tolerance)
+            end = max(trans.date for trans in statement) + timedelta(days=date_tolerance)
+            existing = self.query().active().accounts(account_name).unreconciled().dates(start, end).all()
+
+        matches, unmatched, unmatched_existing = match_transactions(statement, existing, date_tolerance,
+                                                                    min_similarity)
+        return Reconciliation(account_name, matches, unmatched, duplicates, unmatched_existing)
+
+    def apply_reconciliation(self, reconciliation, import_unmatched=True):
+        # In one unit of work, give every matched row the statement's date, vendor, memo and FITID (its
+        # amount is the same and its category is kept) and import the unmatched statement records.
+        # Returns (reconciled, inserted, skipped). Raises IndexError if a matched row was removed or
+        # reconciled since the report was made and TransactionExists if a statement record was imported
+        # meanwhile; nothing is written in those cases.
+        archived_until = self._archived_until()
+        rows = []
+        for match in reconciliation.matches:
+            trans = match.statement
+            self._check_open(trans.date, archived_until)
+            rows.append((str(trans.vendor), str(trans.memo), trans.date, trans.fitid,
+                         transaction_fingerprint(reconciliation.account, trans.date, trans.amount, trans.vendor,
+                                                 trans.memo, trans.fitid),
+                         match.existing.id))
+
+        inserted = skipped = 0
+        try:
+            with self.transaction():
+                if rows:
+                    self.cursor.executemany('''
+                        UPDATE transactions SET vendor = ?, memo = ?, t_date = ?, fitid = ?, fingerprint = ?
+                        WHERE id = ? AND fitid IS NULL
+                    ''', rows)
+                    if self.cursor.rowcount != len(rows):
+                        raise IndexError
+
+                if import_unmatched and reconciliation.unmatched:
+                    inserted, skipped = self.import_transactions(reconciliation.account, reconciliation.unmatched)
+        except sqlite3.IntegrityError:
+            raise TransactionExists
 
-        self.conn.commit()
+        return len(rows), inserted, skipped
 
-    def display_transactions(self):
+    def iter_transactions(self, page_size=PAGE_SIZE, account=None, category=None, start_date=None, end_date=None,
+                          min_amount=None, max_amount=None):
+        # Yield pages of transactions ordered by (t_date, id), each page starting after the last key of the
+        # previous one so no page costs more than an index seek plus page_size rows
+        conditions = []
+        params = []
+
+        if account is not None:
+            conditions.append('account_id = ?')
+            params.append(self._get_account_id(account))
+        if category is not None:
+            conditions.append('category_id = ?')
+            params.append(self._get_category_id(category))
+        if start_date is not None:
+            conditions.append('t_date >= ?')
+            params.append(str(start_date)[:10])
+        if end_date is not None:
+            conditions.append('t_date < ?')
+            params.append(_day_after(end_date))
+        if min_amount is not None:
+            conditions.append('amount >= ?')
+            params.append(to_cents(min_amount))
+        if max_amount is not None:
+            conditions.append('amount <= ?')
+            params.append(to_cents(max_amount))
+
+        # Archived years hold strictly earlier days than the transactions table and each other, so the
+        # partitions the range reaches are paged through one after the other, oldest first
+        years, active = self._partitions(str(start_date)[:10] if start_date is not None else None,
+                                         _day_after(end_date) if end_date is not None else None)
+        if not years:
+            yield from self._iter_partition('transaction_details', conditions, params, page_size)
+            return
+
+        def partitions():
+            # Each archive is only attached once the partitions before it are done
+            for year in years:
+                source = self._union_source([year], False)[0]
+                yield from self._iter_partition(source, conditions, params, page_size)
+            if active:
+                yield from self._iter_partition('transaction_details', conditions, params, page_size)
+
+        yield from _batched(chain.from_iterable(partitions()), page_size)
+
+    def _iter_partition(self, source, conditions, params, page_size):
+        # The stored t_date text is selected after the record's columns and used as the key; the converted
+        # date doesn't always print back as the text it was read from, e.g. for rows written before dates
+        # were normalized
+        query = f'SELECT {TRANSACTION_COLUMNS}, CAST(t_date AS TEXT) FROM {source} WHERE '
+        first_page = ' AND '.join(conditions) if conditions else '1'
+        next_page = ' AND '.join(conditions + ['(t_date, id) > (?, ?)'])
+        order = ' ORDER BY t_date, id LIMIT ?'
+
+        # Use a dedicated cursor so callers can run other queries between pages
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(query + first_page + order, params + [page_size])
+            while True:
+                rows = cursor.fetchall()
+                if not rows:
+                    return
+
+                yield [tuple.__new__(Transaction, row[:-1]) for row in rows]
+
+                if len(rows) < page_size:
+                    return
+
+                last = rows[-1]
+                cursor.execute(query + next_page + order, params + [last[-1], last[0], page_size])
+        finally:
+            cursor.close()
+
+    def search(self, query, account=None, date_range=None, limit=PAGE_SIZE, offset=0):
+        # Transactions whose vendor or memo match an FTS5 query such as 'amazon refund', 'amaz*' or
+        # 'vendor:amazon NOT memo:gift', best matches first; date_range is a (start, end) pair of
+        # inclusive dates, either of which may be None. Use offset to fetch the following pages.
+        conditions = ['transactions_fts MATCH ?']
+        params = [query]
+        start = end = None
+
+        if account is not None:
+            conditions.append('transaction_details.account_id = ?')
+            params.append(self._get_account_id(account))
+        if date_range is not None:
+            start_date, end_date = date_range
+            if start_date is not None:
+                start = str(start_date)[:10]
+                conditions.append('transaction_details.t_date >= ?')
+                params.append(start)
+            if end_date is not None:
+                end = _day_after(end_date)
+                conditions.append('transaction_details.t_date < ?')
+                params.append(end)
+
+        columns = ', '.join(f'transaction_details.{column.strip()}' for column in TRANSACTION_COLUMNS.split(','))
+        where = ' AND '.join(conditions)
+
+        # Each archive file has its own index; their bm25 ranks are merged as they are. More archived
+        # years than SQLite attaches at once are searched group by group, each keeping enough rows to
+        # cover the page, and merged here.
+        groups = self._partition_groups(start, end)
+        if len(groups) == 1:
+            page = [limit, offset]
+        else:
+            page = [limit + offset if limit >= 0 else -1, 0]
+
+        rows = []
+        cursor = self.conn.cursor()
+        try:
+            for years, active in groups:
+                if not years:
+                    cursor.execute(f'''
+                        SELECT {columns}, transactions_fts.rank AS rank
+                        FROM transactions_fts
+                        JOIN transaction_details ON transaction_details.id = transactions_fts.rowid
+                        WHERE {where}
+                        ORDER BY transactions_fts.rank, transaction_details.id
+                        LIMIT ? OFFSET ?
+                    ''', params + page)
+                    rows += cursor.fetchall()
+                    continue
+
+                # Attached right before use, the next group may detach them
+                arms = []
+                if active:
+                    arms.append(f'''
+                        SELECT {columns}, transactions_fts.rank AS rank
+                        FROM transactions_fts
+                        JOIN transaction_details ON transaction_details.id = transactions_fts.rowid
+                        WHERE {where}
+                    ''')
+                for schema in self._attach_archives(years):
+                    arms.append(f'''
+                        SELECT {columns}, transactions_fts.rank AS rank
+                        FROM {schema}.transactions_fts AS transactions_fts
+                        JOIN ({self._archive_details(schema)}) AS transaction_details
+                            ON transaction_details.id = transactions_fts.rowid
+                        WHERE {where}
+                    ''')
+                cursor.execute(f'''
+                    SELECT {TRANSACTION_COLUMNS}, rank FROM ({' UNION ALL '.join(arms)})
+                    ORDER BY rank, id
+                    LIMIT ? OFFSET ?
+                ''', params * len(arms) + page)
+                rows += cursor.fetchall()
+        except sqlite3.OperationalError as error:
+            # Malformed query syntax is the caller's mistake, not a database failure
+            raise ValueError(f"Invalid search query {query!r}: {error}")
+        finally:
+            cursor.close()
+
+        if len(groups) > 1:
+            rows.sort(key=lambda row: (row[-1], row[0]))
+            rows = rows[offset:] if limit < 0 else rows[offset:offset + limit]
+        return [transaction_row_factory(None, row[:-1]) for row in rows]
+
+    def to_arrays(self, cache_path=None, refresh=False):
+        # Column snapshot for the NumPy reports in analytics, imported here so numpy stays optional
+        import analytics
+        return analytics.load_columns(self, cache_path, refresh)
+
+    def display_transactions(self, page_size=PAGE_SIZE):
         # Prompt for category selection
         categories = self.get_categories()
         print("Available Categories:")
@@ -280,91 +2043,80 @@ class TransactionDb:
 
         if category_index < 0 or category_index >= len(categories):
             # Retrieve all transactions
-            self.cursor.execute('SELECT * FROM transactions')
+            selected_category = None
         else:
             # Retrieve transactions for the selected category
             selected_category = categories[category_index]
-            self.cursor.execute('SELECT * FROM transactions WHERE category=?', (selected_category,))
-
-        rows = self.cursor.fetchall()
 
-        if len(rows) == 0:
+        found = False
+
+        for page in self.iter_transactions(page_size, category=selected_category):
+            if not found:
+                sys.stdout.write("-------------------------\nTransactions:\n-------------------------\n")
+                found = True
+
+            # Render the whole page and write it out at once
+            lines = []
+            for trans in page:
+                lines.append(f"ID: {trans.id}\n"
+                             f"Account: {trans.account}\n"
+                             f"Vendor: {trans.vendor}\n"
+                             f"Amount: {float(trans.amount)}\n"
+                             f"Category: {trans.category}\n"
+                             f"Memo: {trans.memo}\n"
+                             f"Date: {trans.date}\n"
+                             "-----------------------\n")
+            sys.stdout.write(''.join(lines))
+            sys.stdout.flush()
+
+            if len(page) == page_size and input("Press ENTER for the next page, or q to stop: ").lower() == 'q':
+                break
+
+        if not found:
             print("No transactions found.")
-        else:
-            print("-------------------------")
-            print("Transactions:")
-            print("-------------------------")
-            for row in rows:
-                print("ID:", row[0])
-                print("Account:", row[1])
-                print("Vendor:", row[2])
-                print("Amount:", float(row[3]))
-                print("Category:", row[4])
-                print("Memo:", row[5])
-                print("Date:", row[6])
-                print("-----------------------")
+
+    def query(self):
+        # Start a TransactionQuery over every transaction
+        return TransactionQuery(self)
+
+    def _get_ids(self, table, names):
+        # Ids of the named accounts or categories, skipping names that don't exist
+        ids = self._lookups()[table]
+        return sorted(ids[name] for name in set(str(name).lower() for name in names) if name in ids)
 
     def filter_transactions(self, id=None, vendor=None, amount=None, category=None, memo=None, date=None):
-        query = 'SELECT * FROM transactions WHERE '
-        conditions = []
-        params = []
+        # Exact-match shortcut over query(); with no arguments every transaction is returned
+        query = self.query()
 
         if id is not None:
-            conditions.append('id = ?')
-            params.append(str(id))
+            query = query.ids(id)
         if vendor is not None:
-            conditions.append('vendor = ?')
-            params.append(str(vendor))
+            query = query.vendor(vendor)
         if amount is not None:
-            conditions.append('amount = ?')
-            params.append(str(amount))
+            query = query.amount(amount)
         if category is not None:
-            conditions.append('category = ?')
-            params.append(str(category))
+            query = query.categories(category)
         if memo is not None:
-            conditions.append('memo = ?')
-            params.append(str(memo))
+            query = query.memo(memo)
         if date is not None:
-            conditions.append('t_date = ?')
-            params.append(str(date))
-
-        if conditions:
-            query += ' AND '.join(conditions)
-
-        self.cursor.execute(query, params)
+            query = query.on(date)
 
-        transactions = self.cursor.fetchall()
-
-        return_trans = []
-
-        for transaction in transactions:
-            id = transaction[0]
-            account = transaction[1]
-            vendor = transaction[2]
-            amount = Decimal(str(transaction[3]))
-            category = transaction[4]
-            memo = transaction[5]
-            date = transaction[6]
-
-            return_trans.append(Transaction(id, account, vendor, amount, category, memo, date))
-
-        return return_trans
+        return query.all()
 
     def get_transaction(self, id):
         # Retrieve the transaction from the database
-        self.cursor.execute('SELECT * FROM transactions WHERE id=?', (id,))
-        transaction = self.cursor.fetchone()
+        cursor = self.conn.cursor()
+        cursor.row_factory = transaction_row_factory
+        cursor.execute(f'SELECT {TRANSACTION_COLUMNS} FROM transaction_details WHERE id=?', (id,))
+        transaction = cursor.fetchone()
+        cursor.close()
+
+        # Only look through the archives for ids the transactions table doesn't have
+        if not transaction and self._lookups()['archives']:
+            transaction = self.query().ids(id).first()
 
         # Check if the transaction exists
         if not transaction:
             raise IndexError
 
-        # Extract transaction details
-        id = transaction[0]
-        vendor = transaction[1]
-        amount = Decimal(str(transaction[2]))
-        category = transaction[3]
-        memo = transaction[4]
-        date = transaction[5]
-
-        return Transaction( id, vendor, amount, category, memo, date)
\ No newline at end of file
+        return transaction